@@ -0,0 +1,182 @@
+import bisect
+import cv2
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import TEMP_DIR, SEGMENT_MIN_SECONDS, DETECTION_CACHE_ENABLED, RENDITIONS, ensure_directories
+from decoder import frame_times, probe_video
+from detection_cache import DetectionCache
+from detector import PersonDetector
+from edit_plan import EditPlan, prepare_plan
+from editor import AutoVideoEditor
+from effects import VideoEffects
+from encoder import find_keyframes, concat_segments
+from renditions import join_renditions
+from speed_ramp import SpeedRamp
+from text_overlay import TextOverlay
+
+_editor = None
+
+def _init_worker(workers):
+    global _editor
+    # Split the cores between workers instead of letting every process's
+    # OpenCV and torch thread pools claim all of them.
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    cv2.setNumThreads(threads)
+    _editor = AutoVideoEditor(detector=PersonDetector(num_threads=threads))
+
+def _render(input_path, output_path, preview=False):
+    started = time.time()
+    status = {"input": input_path, "output": output_path, "pid": os.getpid(), "ok": False, "error": None}
+    try:
+        _editor.effects = VideoEffects()
+        _editor.text_overlay = TextOverlay()
+        status["ok"] = bool(_editor.process_video(input_path, output_path, preview=preview))
+        if not status["ok"]:
+            status["error"] = "process_video failed"
+    except Exception:
+        status["error"] = traceback.format_exc()
+    status["seconds"] = time.time() - started
+    return status
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def run_batch(jobs, workers, preview=False):
+    # Largest inputs go first so a long video never starts last and leaves
+    # the other workers idle at the end of the batch.
+    jobs = sorted(jobs, key=lambda job: _file_size(job[0]), reverse=True)
+    workers = max(1, min(workers, len(jobs)))
+    results = []
+
+    print(f"Rendering {len(jobs)} video(s) with {workers} worker process(es)")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(workers,)) as pool:
+        futures = {pool.submit(_render, input_path, output_path, preview): input_path for input_path, output_path in jobs}
+        for future in as_completed(futures):
+            try:
+                status = future.result()
+            except Exception as e:
+                status = {"input": futures[future], "output": None, "pid": None, "ok": False,
+                          "error": f"worker crashed: {e}", "seconds": 0.0}
+            results.append(status)
+            state = "OK" if status["ok"] else "FAILED"
+            print(f"[{len(results)}/{len(jobs)}] {state} {status['input']} ({status['seconds']:.1f}s)")
+
+    failures = [status for status in results if not status["ok"]]
+    print(f"Batch finished: {len(results) - len(failures)} succeeded, {len(failures)} failed")
+    for status in failures:
+        print(f"FAILED {status['input']}:\n{status['error']}")
+    return results
+
+def plan_segments(total_frames, keyframes, count, min_frames):
+    # Cut points snap to the keyframe nearest each even split, so every
+    # segment starts on a frame the decoder can seek to directly.
+    candidates = sorted(set(k for k in keyframes if 0 < k < total_frames)) if keyframes else None
+    bounds = [0]
+    for i in range(1, count):
+        target = total_frames * i // count
+        cut = min(candidates, key=lambda k: abs(k - target)) if candidates else target
+        if cut - bounds[-1] >= min_frames and total_frames - cut >= min_frames:
+            bounds.append(cut)
+    return [(start, end) for start, end in zip(bounds, bounds[1:] + [None])]
+
+def _render_segment(input_path, segment_path, start_frame, end_frame, plan_data, cache_path, renditions=()):
+    started = time.time()
+    # Every frame is a pure function of the shared edit plan, so effects and
+    # captions that span a cut continue seamlessly into the next segment.
+    plan = EditPlan.from_dict(plan_data)
+    _editor.effects = VideoEffects(plan)
+    _editor.text_overlay = TextOverlay(plan)
+    cache = DetectionCache(cache_path) if cache_path else None
+    frames, thumbnail, _ = _editor.render_segment(input_path, segment_path, start_frame, end_frame,
+                                               SpeedRamp.from_plan(plan), cache, renditions=renditions)
+    return {
+        "segment": segment_path,
+        "frames": frames,
+        "thumbnail": thumbnail,
+        "detections": cache.new_entries() if cache is not None else {},
+        "seconds": time.time() - started,
+    }
+
+def run_segmented(input_path, output_path, workers, seed=None, plan_path=None, renditions=RENDITIONS):
+    info = probe_video(input_path)
+    if info is None:
+        print(f"Error opening video: {input_path}")
+        return False
+    fps = info["fps"]
+    width, height, total_frames = info["width"], info["height"], info["frame_count"]
+
+    keyframe_times = find_keyframes(input_path)
+    if keyframe_times is None:
+        print("Could not list keyframes, splitting at even frame counts")
+    keyframes = None
+    if keyframe_times:
+        # Keyframe times become frame indices through the real frame
+        # timestamps, which also holds for variable frame rate video.
+        times = frame_times(input_path)
+        if times:
+            keyframes = [bisect.bisect_left(times, t - 1e-6) for t in keyframe_times]
+        else:
+            keyframes = [int(round(t * fps)) for t in keyframe_times]
+    segments = plan_segments(total_frames, keyframes, workers, int(SEGMENT_MIN_SECONDS * fps))
+    if len(segments) < 2:
+        print("Video too short to split, rendering in one process")
+        editor = AutoVideoEditor()
+        editor.renditions = renditions
+        return editor.process_video(input_path, output_path, seed=seed, plan_path=plan_path)
+
+    cache = DetectionCache.for_video(input_path) if DETECTION_CACHE_ENABLED else None
+    plan = prepare_plan(total_frames, width, height, seed=seed, plan_path=plan_path)
+    ramp = SpeedRamp.from_plan(plan)
+    ensure_directories()
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=TEMP_DIR)
+    segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.mp4") for i in range(len(segments))]
+    print(f"Rendering {input_path} as {len(segments)} segment(s), edit plan seed {plan.seed}")
+
+    try:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(segments), mp_context=context,
+                                 initializer=_init_worker, initargs=(len(segments),)) as pool:
+            futures = [
+                pool.submit(_render_segment, input_path, segment_path, start, end, plan.to_dict(),
+                            cache.path if cache is not None else None, renditions)
+                for segment_path, (start, end) in zip(segment_paths, segments)
+            ]
+            thumbnails = {}
+            for future in as_completed(futures):
+                status = future.result()
+                thumbnails[status["segment"]] = status["thumbnail"]
+                if cache is not None:
+                    cache.update(status["detections"])
+                print(f"Segment {os.path.basename(status['segment'])}: {status['frames']} frames ({status['seconds']:.1f}s)")
+
+        print("Joining segments...")
+        temp_output = os.path.join(work_dir, "joined" + os.path.splitext(output_path)[1])
+        audio_tempo = ramp.audio_tempo(fps)
+        concat_segments(segment_paths, temp_output, os.path.join(work_dir, "segments.txt"),
+                        audio_source=input_path, audio_tempo=audio_tempo)
+        join_renditions(renditions, segment_paths, output_path, work_dir, audio_source=input_path,
+                        audio_tempo=audio_tempo, thumbnail_scores=[thumbnails.get(path) for path in segment_paths])
+        shutil.move(temp_output, output_path)
+    except Exception as e:
+        print(f"Error rendering segments: {e}")
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"Error saving detection cache: {e}")
+    print(f"Done! Output saved to: {output_path}")
+    return True
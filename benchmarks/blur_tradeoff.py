@@ -0,0 +1,56 @@
+import argparse
+import json
+import time
+import cv2
+import numpy as np
+from benchmarks.synthetic import RESOLUTIONS, synthetic_frame
+from effects import VideoEffects
+
+BLURS = {"glow": 30, "blur_background": 3.5}
+
+def time_blur(effects, frame, sigma, downscale, repeats):
+    effects.blur(frame, sigma, downscale)
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = effects.blur(frame, sigma, downscale)
+        times.append(time.perf_counter() - started)
+    return result, float(np.median(times))
+
+def run(resolutions, downscales, repeats):
+    effects = VideoEffects()
+    results = []
+    for name in resolutions:
+        width, height = RESOLUTIONS[name]
+        frame = synthetic_frame(width, height)
+        for blur, sigma in BLURS.items():
+            reference, full_time = time_blur(effects, frame, sigma, 1, repeats)
+            for downscale in downscales:
+                result, seconds = time_blur(effects, frame, sigma, downscale, repeats)
+                psnr = cv2.PSNR(reference, result)
+                results.append({
+                    "resolution": name, "blur": blur, "sigma": sigma, "downscale": downscale,
+                    "ms": seconds * 1000, "speedup": full_time / seconds,
+                    "psnr_db": None if np.isinf(psnr) or psnr > 100 else psnr,
+                })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Speed/quality trade-off of the downscaled blur path")
+    parser.add_argument("--resolutions", nargs="+", default=["1080p", "4k"], choices=list(RESOLUTIONS))
+    parser.add_argument("--downscales", nargs="+", type=int, default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.resolutions, args.downscales, args.repeats)
+    print(f"{'res':<6} {'blur':<16} {'scale':>5} {'ms':>9} {'speedup':>8} {'PSNR dB':>8}")
+    for r in results:
+        psnr = "exact" if r["psnr_db"] is None else f"{r['psnr_db']:.1f}"
+        print(f"{r['resolution']:<6} {r['blur']:<16} {'1/' + str(r['downscale']):>5} {r['ms']:>9.2f} {r['speedup']:>7.1f}x {psnr:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from benchmarks.run import load_frames
+from benchmarks.synthetic import synthetic_clip
+from config import DETECTION_CONFIDENCE
+from detector_backends import BACKENDS, create_backend
+
+def box_iou(a, b):
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def match(reference, candidate, min_iou, margin):
+    # Greedy one-to-one matching by IoU. Boxes scored within `margin` of the
+    # confidence threshold may legitimately appear on one side only, so
+    # they are not counted as misses.
+    stats = {"matched": 0, "missed": 0, "extra": 0, "ious": [], "coord_errors": [], "score_errors": []}
+    iou = box_iou(reference, candidate) if len(reference) and len(candidate) else np.zeros((len(reference), len(candidate)))
+    used_ref, used_cand = set(), set()
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < min_iou:
+            break
+        if i in used_ref or j in used_cand:
+            continue
+        used_ref.add(i)
+        used_cand.add(j)
+        stats["matched"] += 1
+        stats["ious"].append(float(iou[i, j]))
+        stats["coord_errors"].append(float(np.abs(reference[i, :4] - candidate[j, :4]).max()))
+        stats["score_errors"].append(float(abs(reference[i, 4] - candidate[j, 4])))
+    borderline = DETECTION_CONFIDENCE + margin
+    stats["missed"] = sum(1 for i in range(len(reference)) if i not in used_ref and reference[i, 4] >= borderline)
+    stats["extra"] = sum(1 for j in range(len(candidate)) if j not in used_cand and candidate[j, 4] >= borderline)
+    return stats
+
+def run_backend(backend, frames, batch_size):
+    detections = []
+    started = time.perf_counter()
+    for start in range(0, len(frames), batch_size):
+        detections.extend(backend.detect_batch(frames[start:start + batch_size]))
+    return detections, (time.perf_counter() - started) * 1000 / len(frames)
+
+def compare(reference, candidate, min_iou, margin):
+    totals = {"matched": 0, "missed": 0, "extra": 0, "ious": [], "coord_errors": [], "score_errors": []}
+    for ref, cand in zip(reference, candidate):
+        stats = match(ref, cand, min_iou, margin)
+        for key, value in stats.items():
+            totals[key] += value
+    return {
+        "reference_boxes": sum(len(ref) for ref in reference),
+        "matched": totals["matched"],
+        "missed": totals["missed"],
+        "extra": totals["extra"],
+        "min_iou": min(totals["ious"], default=None),
+        "mean_iou": float(np.mean(totals["ious"])) if totals["ious"] else None,
+        "max_coord_error_px": max(totals["coord_errors"], default=None),
+        "max_score_error": max(totals["score_errors"], default=None),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CPU detection backends against the torch backend and time them")
+    parser.add_argument("--video", help="clip with people in it (default: a synthetic 1080p clip)")
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--backends", nargs="+", default=["onnx"], choices=[name for name in BACKENDS if name != "torch"])
+    parser.add_argument("--model", action="append", default=[], metavar="BACKEND=PATH",
+                        help="model file for a backend, e.g. onnx=yolov8n-int8.onnx")
+    parser.add_argument("--threads", type=int, help="inference threads for every backend")
+    parser.add_argument("--match-iou", type=float, default=0.5, help="IoU at which two boxes are the same person")
+    parser.add_argument("--min-iou", type=float, default=0.85, help="fail if a matched pair overlaps less than this")
+    parser.add_argument("--margin", type=float, default=0.05,
+                        help="ignore unmatched boxes scored within this of DETECTION_CONFIDENCE")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    models = dict(spec.split("=", 1) for spec in args.model)
+    path = args.video or synthetic_clip("1080p", args.frames)
+    frames = load_frames(path, args.frames)
+    if not args.video:
+        print("Synthetic frames contain no people; pass --video for a meaningful box comparison")
+
+    torch_backend = create_backend("torch", models.get("torch"), num_threads=args.threads)
+    run_backend(torch_backend, frames[:args.batch_size], args.batch_size)
+    reference, reference_ms = run_backend(torch_backend, frames, args.batch_size)
+    results = {"torch": {"ms_per_frame": reference_ms, "boxes": sum(len(r) for r in reference)}}
+    failures = []
+    for name in args.backends:
+        backend = create_backend(name, models.get(name), num_threads=args.threads)
+        run_backend(backend, frames[:args.batch_size], args.batch_size)
+        detections, ms = run_backend(backend, frames, args.batch_size)
+        result = compare(reference, detections, args.match_iou, args.margin)
+        result.update({"model": backend.model_path, "ms_per_frame": ms, "speedup": reference_ms / ms})
+        results[name] = result
+        if result["missed"] or result["extra"]:
+            failures.append(f"{name}: {result['missed']} missed and {result['extra']} extra boxes")
+        if result["min_iou"] is not None and result["min_iou"] < args.min_iou:
+            failures.append(f"{name}: matched boxes overlap only {result['min_iou']:.2f} IoU")
+
+    print(f"{'backend':<10} {'ms/frame':>9} {'speedup':>8} {'matched':>8} {'missed':>7} {'extra':>6} {'min IoU':>8} {'max px':>7}")
+    for name, r in results.items():
+        if name == "torch":
+            print(f"{name:<10} {r['ms_per_frame']:>9.1f} {'1.0x':>8} {r['boxes']:>8}")
+            continue
+        min_iou = "-" if r["min_iou"] is None else f"{r['min_iou']:.3f}"
+        max_px = "-" if r["max_coord_error_px"] is None else f"{r['max_coord_error_px']:.1f}"
+        print(f"{name:<10} {r['ms_per_frame']:>9.1f} {r['speedup']:>7.1f}x {r['matched']:>8} {r['missed']:>7} "
+              f"{r['extra']:>6} {min_iou:>8} {max_px:>7}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        print("PARITY FAILURE:")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from benchmarks.stub_detector import StubDetector
+from benchmarks.synthetic import RESOLUTIONS, crowd_boxes, person_boxes, synthetic_clip
+from decoder import FFmpegFrameReader
+from edit_plan import EditPlan
+from effects import VideoEffects
+from encoder import FFmpegPipeWriter
+from text_overlay import TextOverlay
+
+# People in the crowd-shot overlay cases.
+CROWD_SIZE = 40
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    if resource is None:
+        return None
+    scale = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return {"self": own, "children": children}
+
+def summarize(latencies, frames=None, wall=None):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    frames = len(latencies) if frames is None else frames
+    wall = latencies.sum() / 1000 if wall is None else wall
+    stats = {"frames": frames, "seconds": wall, "fps": frames / wall if wall > 0 else None}
+    if len(latencies):
+        stats.update({
+            "mean_ms": float(latencies.mean()),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p90_ms": float(np.percentile(latencies, 90)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+        })
+    return stats
+
+def time_calls(fn, frames, warmup, repeats):
+    for i in range(warmup):
+        fn(frames[i % len(frames)], i)
+    latencies = []
+    for _ in range(repeats):
+        for i, frame in enumerate(frames):
+            started = time.perf_counter()
+            fn(frame, i)
+            latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+def load_frames(path, count):
+    reader = FFmpegFrameReader(path, ring_size=2)
+    frames = []
+    try:
+        while len(frames) < count:
+            ok, frame = reader.read()
+            if not ok:
+                break
+            frames.append(frame.copy())
+    finally:
+        reader.release()
+    return frames
+
+def bench_effects(frames, warmup, repeats):
+    h, w = frames[0].shape[:2]
+    effects = VideoEffects(EditPlan.generate(0, len(frames), w, h))
+    out = np.empty_like(frames[0])
+    mask = np.zeros((h, w), dtype=np.uint8)
+    x1, y1, x2, y2 = person_boxes(w, h)[0, :4].astype(int)
+    mask[y1:y2, x1:x2] = 255
+    detections = person_boxes(w, h)
+    cases = {
+        "zoom": lambda f, i: effects.apply_zoom(f, 1.2, out=out),
+        "shake": lambda f, i: effects.apply_shake(f, 6, out=out),
+        "flash": lambda f, i: effects.apply_flash(f, 0.4, out=out),
+        "glow": lambda f, i: effects.apply_glow(f, 0.4, out=out),
+        "chromatic": lambda f, i: effects.apply_chromatic_aberration(f, 5, out=out),
+        "blur_background": lambda f, i: effects.apply_blur_background(f, mask, out=out),
+        "finish_cinematic": lambda f, i: effects.apply_finish(f, "cinematic", out=out),
+        "finish_warm": lambda f, i: effects.apply_finish(f, "warm", out=out),
+        "process_frame": lambda f, i: effects.process_frame(f, detections, i, len(frames), out=out),
+    }
+    return {f"effects.{name}": time_calls(fn, frames, warmup, repeats) for name, fn in cases.items()}
+
+def bench_overlay(frames, warmup, repeats):
+    h, w = frames[0].shape[:2]
+    overlay = TextOverlay(EditPlan.generate(0, len(frames), w, h))
+    out = np.empty_like(frames[0])
+    detections = person_boxes(w, h)
+    crowd = crowd_boxes(w, h, CROWD_SIZE)
+    position = (50, h // 2)
+
+    # Overlays draw in place, so each call starts from a fresh copy of the
+    # frame; the copy is part of every measurement and of the baseline.
+    def fresh(f):
+        np.copyto(out, f)
+        return out
+
+    cases = {
+        "outlined_text": lambda f, i: overlay.add_outlined_text(fresh(f), "LEGENDARY", position, 45),
+        "animated_text": lambda f, i: overlay.add_animated_text(fresh(f), "LEGENDARY", position, i, 45),
+        "glitch_text": lambda f, i: overlay.add_glitch_text(fresh(f), "LEGENDARY", position, 45),
+        "tracking_lines": lambda f, i: overlay.add_tracking_lines(fresh(f), detections[0, :4]),
+        "person_label": lambda f, i: overlay.add_person_label(fresh(f), detections[0, :4], confidence=0.9),
+        "detections": lambda f, i: overlay.add_detection_overlays(fresh(f), detections),
+        "detections_crowd": lambda f, i: overlay.add_detection_overlays(fresh(f), crowd),
+        "process_frame": lambda f, i: overlay.process_frame(f, detections, i, len(frames), out=out),
+        "process_frame_crowd": lambda f, i: overlay.process_frame(f, crowd, i, len(frames), out=out),
+    }
+    return {f"overlay.{name}": time_calls(fn, frames, warmup, repeats) for name, fn in cases.items()}
+
+def bench_decode(path, repeats):
+    latencies = []
+    wall = 0.0
+    frames = 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        reader = FFmpegFrameReader(path, ring_size=4)
+        while True:
+            t = time.perf_counter()
+            ok, _ = reader.read()
+            if not ok:
+                break
+            latencies.append(time.perf_counter() - t)
+            frames += 1
+        reader.release()
+        wall += time.perf_counter() - started
+    return {"decode": summarize(latencies, frames, wall)}
+
+def bench_encode(frames, repeats, work_dir):
+    h, w = frames[0].shape[:2]
+    latencies = []
+    wall = 0.0
+    for r in range(repeats):
+        path = os.path.join(work_dir, f"encode_{r}.mp4")
+        started = time.perf_counter()
+        writer = FFmpegPipeWriter(path, w, h, 30)
+        for frame in frames:
+            t = time.perf_counter()
+            writer.write(frame)
+            latencies.append(time.perf_counter() - t)
+        writer.close()
+        wall += time.perf_counter() - started
+    return {"encode": summarize(latencies, len(frames) * repeats, wall)}
+
+def bench_process_video(path, frame_count, repeats, work_dir):
+    # Imported here so the per-stage benchmarks run even where the full
+    # editor's dependencies are not installed.
+    from editor import AutoVideoEditor
+    editor = AutoVideoEditor(detector=StubDetector())
+    editor.use_detection_cache = False
+    wall = 0.0
+    for r in range(repeats):
+        editor.effects = VideoEffects()
+        editor.text_overlay = TextOverlay()
+        output_path = os.path.join(work_dir, f"process_{r}.mp4")
+        started = time.perf_counter()
+        if not editor.process_video(path, output_path, seed=r):
+            raise RuntimeError(f"process_video failed on {path}")
+        wall += time.perf_counter() - started
+    return {"process_video": summarize([], frame_count * repeats, wall)}
+
+def run(resolutions, frame_count, warmup, repeats, include_process_video=True):
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {"frames": frame_count, "warmup": warmup, "repeats": repeats},
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench_") as work_dir:
+        for resolution in resolutions:
+            print(f"== {resolution}")
+            path = synthetic_clip(resolution, frame_count)
+            frames = load_frames(path, frame_count)
+            stages = {}
+            stages.update(bench_decode(path, repeats))
+            stages.update(bench_effects(frames, warmup, repeats))
+            stages.update(bench_overlay(frames, warmup, repeats))
+            stages.update(bench_encode(frames, repeats, work_dir))
+            if include_process_video:
+                stages.update(bench_process_video(path, len(frames), repeats, work_dir))
+            for name, stats in stages.items():
+                print(f"  {name:<28} {stats['fps']:>9.1f} fps  p50 {stats.get('p50_ms', float('nan')):>8.2f} ms"
+                      f"  p99 {stats.get('p99_ms', float('nan')):>8.2f} ms")
+            report["results"][resolution] = stages
+            del frames
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+def compare(report, baseline, tolerance):
+    # A stage regresses when its throughput drops, or peak memory grows, by
+    # more than `tolerance` relative to the baseline.
+    regressions = []
+    for resolution, stages in report["results"].items():
+        for name, stats in stages.items():
+            base = baseline.get("results", {}).get(resolution, {}).get(name)
+            if not base or not base.get("fps") or not stats.get("fps"):
+                continue
+            change = stats["fps"] / base["fps"] - 1
+            if change < -tolerance:
+                regressions.append(f"{resolution} {name}: {stats['fps']:.1f} fps vs baseline {base['fps']:.1f} ({change:+.0%})")
+    rss, base_rss = report.get("peak_rss_mb"), baseline.get("peak_rss_mb")
+    if rss and base_rss and base_rss.get("self") and rss["self"] > base_rss["self"] * (1 + tolerance):
+        regressions.append(f"peak RSS {rss['self']:.0f} MB vs baseline {base_rss['self']:.0f} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmarks on synthetic clips with a stub detector")
+    parser.add_argument("--resolutions", nargs="+", default=["480p", "1080p"], choices=list(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=90, help="frames per synthetic clip")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--skip-process-video", action="store_true", help="only time the individual stages")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against a report saved earlier and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    report = run(args.resolutions, args.frames, args.warmup, args.repeats, not args.skip_process_video)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"REGRESSION: {len(regressions)} stage(s) slower than baseline by more than {args.tolerance:.0%}")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "ultralytics", "moviepy")
+
+# Each case runs in a fresh interpreter inside an empty directory, so the
+# timing includes every import it triggers and any directory it creates
+# shows up in the report.
+CASES = {
+    "python": "pass",
+    "main --help": f"import runpy, sys; sys.argv = ['main.py', '--help']; runpy.run_path({os.path.join(ROOT, 'main.py')!r}, run_name='__main__')",
+    "import config": "import config",
+    "import editor": "import editor",
+    "AutoVideoEditor()": "from editor import AutoVideoEditor; AutoVideoEditor()",
+}
+
+REPORT = (
+    "import atexit, sys\n"
+    f"atexit.register(lambda: print('HEAVY=' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr))\n"
+)
+
+def time_case(code, repeats):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    times = []
+    heavy = []
+    created = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory(prefix="startup_") as cwd:
+            started = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-c", REPORT + code], cwd=cwd, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            times.append(time.perf_counter() - started)
+            if proc.returncode != 0:
+                raise RuntimeError(f"startup case failed:\n{proc.stderr}")
+            heavy = [line[6:] for line in proc.stderr.splitlines() if line.startswith("HEAVY=")][-1].split(",")
+            created = sorted(os.listdir(cwd))
+    times = np.asarray(times) * 1000
+    return {
+        "median_ms": float(np.median(times)),
+        "min_ms": float(times.min()),
+        "max_ms": float(times.max()),
+        "heavy_imports": [name for name in heavy if name],
+        "created": created,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of the CLI and editor in fresh interpreters")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, help="fail if any case's median start-up exceeds this")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = {name: time_case(code, args.repeats) for name, code in CASES.items()}
+    failures = []
+    print(f"{'case':<20} {'median ms':>10} {'min ms':>8}  heavy imports / created")
+    for name, r in results.items():
+        extra = ", ".join(r["heavy_imports"] + [f"{d}/" for d in r["created"]]) or "-"
+        print(f"{name:<20} {r['median_ms']:>10.1f} {r['min_ms']:>8.1f}  {extra}")
+        if r["heavy_imports"]:
+            failures.append(f"{name} imported {', '.join(r['heavy_imports'])}")
+        if r["created"]:
+            failures.append(f"{name} created {', '.join(r['created'])} at import")
+        if args.max_ms is not None and r["median_ms"] > args.max_ms:
+            failures.append(f"{name} took {r['median_ms']:.0f} ms (budget {args.max_ms:.0f} ms)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if failures:
+        print("STARTUP REGRESSION:")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
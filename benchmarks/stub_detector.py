@@ -0,0 +1,23 @@
+from benchmarks.synthetic import person_boxes
+from detector import PersonDetector
+
+class StubBackend:
+    # Stands in for a detection runtime without torch or model weights:
+    # every frame gets the same boxes, scaled to the frame size.
+    name = "stub"
+    model_path = "stub"
+
+    def __init__(self):
+        self.calls = 0
+        self.frames = 0
+
+    def detect_batch(self, frames):
+        self.calls += 1
+        self.frames += len(frames)
+        return [person_boxes(frame.shape[1], frame.shape[0]) for frame in frames]
+
+class StubDetector(PersonDetector):
+    # Only model loading is replaced, so batching, masks and main-person
+    # selection run the real PersonDetector code.
+    def _load_model(self):
+        self.model = StubBackend()
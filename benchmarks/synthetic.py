@@ -0,0 +1,62 @@
+import os
+import cv2
+import numpy as np
+from config import TEMP_DIR
+from encoder import FFmpegPipeWriter
+
+RESOLUTIONS = {"480p": (854, 480), "1080p": (1920, 1080), "4k": (3840, 2160)}
+
+def synthetic_frame(width, height, seed=0):
+    # Smooth structure plus grain, so both the low and high frequencies a
+    # real frame has are present.
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, (max(height // 16, 1), max(width // 16, 1), 3), dtype=np.uint8)
+    frame = cv2.resize(base, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.add(frame, rng.integers(0, 40, frame.shape, dtype=np.uint8))
+
+def person_boxes(width, height):
+    # Two fixed "people" in the proportions of a standing person, shared by
+    # the synthetic clips and the stub detector.
+    return np.array([
+        [0.40 * width, 0.20 * height, 0.60 * width, 0.95 * height, 0.92, 0],
+        [0.08 * width, 0.35 * height, 0.22 * width, 0.90 * height, 0.71, 0],
+    ], dtype=np.float32)
+
+def crowd_boxes(width, height, count, seed=0):
+    # A crowd shot: `count` smaller, overlapping people spread over the frame.
+    rng = np.random.default_rng(seed)
+    box_w = rng.uniform(0.03, 0.07, count) * width
+    box_h = box_w * rng.uniform(2.2, 3.0, count)
+    x1 = rng.uniform(0, width - box_w)
+    y1 = rng.uniform(0.1 * height, np.maximum(0.1 * height, height - box_h))
+    confidence = rng.uniform(0.5, 0.95, count)
+    return np.stack([x1, y1, x1 + box_w, y1 + box_h, confidence, np.zeros(count)], axis=1).astype(np.float32)
+
+def make_clip(path, width, height, frames, fps=30):
+    background = synthetic_frame(width, height)
+    boxes = person_boxes(width, height).astype(int)
+    writer = FFmpegPipeWriter(path, width, height, fps)
+    try:
+        for i in range(frames):
+            # Pan the background and move the boxes so the encoder and the
+            # scene-change detector see motion.
+            frame = np.roll(background, 4 * i, axis=1)
+            for n, (x1, y1, x2, y2, _, _) in enumerate(boxes):
+                dx = int(20 * np.sin(i / 15 + n))
+                cv2.rectangle(frame, (x1 + dx, y1), (x2 + dx, y2), (40 + 90 * n, 160, 220), -1)
+            writer.write(frame)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return path
+
+def synthetic_clip(resolution, frames, fps=30, directory=None):
+    directory = directory or os.path.join(TEMP_DIR, "benchmarks")
+    os.makedirs(directory, exist_ok=True)
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(directory, f"synthetic_{resolution}_{frames}f_{fps}fps.mp4")
+    if not os.path.exists(path):
+        print(f"Generating {path}")
+        make_clip(path, width, height, frames, fps)
+    return path
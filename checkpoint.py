@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import shutil
+from config import CHECKPOINT_DIR
+from renditions import rendition_path
+
+def _normalized(value):
+    # Compared against what was read back from JSON, so tuples become lists.
+    return json.loads(json.dumps(value))
+
+def boundary_state(plan, speed_ramp, frame_idx):
+    # Everything the effects and overlay carry into a frame comes from the
+    # plan at that index (their per-frame RNGs are seeded from it too), and
+    # the speed ramp places the frame on the output timeline, so this is
+    # the full render state at a chunk boundary.
+    return _normalized({
+        "frame": frame_idx,
+        "seed": plan.seed,
+        "effect": plan.effect_at(frame_idx),
+        "caption": plan.caption_at(frame_idx),
+        "grade": plan.grade_at(frame_idx),
+        "speed": speed_ramp.speed_at(frame_idx),
+        "output_frame": speed_ramp.output_frames(frame_idx),
+    })
+
+def chunk_bounds(total_frames, chunk_frames):
+    # The last chunk is open-ended so it runs to the real end of the stream
+    # even when the container's frame count is approximate.
+    starts = list(range(0, max(total_frames, 1), chunk_frames))
+    return [(start, end) for start, end in zip(starts, starts[1:] + [None])]
+
+# A checkpointed render lives in its own directory: manifest.json plus one
+# video-only file per finished chunk. The directory name hashes the input
+# (path, size, mtime) and the output path, so rerunning the same job finds
+# it, and a changed input starts over.
+class RenderManifest:
+    def __init__(self, path, input_path, output_path):
+        self.path = path
+        self.input_path = input_path
+        self.output_path = output_path
+        self.data = None
+
+    @classmethod
+    def for_job(cls, input_path, output_path, checkpoint_dir=CHECKPOINT_DIR):
+        stat = os.stat(input_path)
+        key = hashlib.blake2b(digest_size=16)
+        key.update(f"{os.path.abspath(input_path)}|{stat.st_size}|{stat.st_mtime_ns}|{os.path.abspath(output_path)}".encode())
+        return cls(os.path.join(checkpoint_dir, key.hexdigest()), input_path, output_path)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = None
+        return self.data
+
+    def begin(self, plan, bounds, speed_ramp, renditions=()):
+        # Keeps the finished chunks of an earlier attempt only if it used
+        # the same plan, chunking and renditions, and each chunk's recorded
+        # boundary state still matches what this code derives from the plan.
+        plan_data = _normalized(plan.to_dict())
+        previous = self.data if self.data is not None else self.load()
+        chunks = [{"start": start, "end": end, "file": f"chunk_{i:04d}.mp4", "done": False,
+                   "state": boundary_state(plan, speed_ramp, start)} for i, (start, end) in enumerate(bounds)]
+        if previous and previous.get("plan") == plan_data and previous.get("renditions", []) == list(renditions) \
+                and [(c["start"], c["end"]) for c in previous.get("chunks", [])] == [tuple(b) for b in bounds]:
+            for chunk, old in zip(chunks, previous["chunks"]):
+                if old.get("done") and old.get("state") == chunk["state"] \
+                        and os.path.exists(os.path.join(self.path, old["file"])):
+                    chunk.update(done=True, frames=old.get("frames"), seconds=old.get("seconds"),
+                                 thumbnail=old.get("thumbnail"), rendition_state=old.get("rendition_state"))
+        else:
+            self.remove()
+        self.data = {
+            "input": self.input_path,
+            "output": self.output_path,
+            "plan": plan_data,
+            "renditions": list(renditions),
+            "chunks": chunks,
+        }
+        os.makedirs(self.path, exist_ok=True)
+        self.save()
+        return sum(1 for chunk in chunks if chunk["done"])
+
+    def chunk_path(self, index):
+        return os.path.join(self.path, self.data["chunks"][index]["file"])
+
+    def partial_path(self, index):
+        return os.path.join(self.path, f"chunk_{index:04d}.partial.mp4")
+
+    def is_done(self, index):
+        return self.data["chunks"][index]["done"]
+
+    def complete(self, index, frames, seconds, thumbnail=None, rendition_state=None):
+        # The chunk's files are moved into place before the manifest records
+        # it, so a chunk marked done always exists whole. thumbnail is the
+        # score of the chunk's thumbnail pick, if it has one, and
+        # rendition_state what the renditions carry into the next chunk.
+        for name in self.data["renditions"]:
+            partial = rendition_path(self.partial_path(index), name)
+            if os.path.exists(partial):
+                os.replace(partial, rendition_path(self.chunk_path(index), name))
+        os.replace(self.partial_path(index), self.chunk_path(index))
+        self.data["chunks"][index].update(done=True, frames=frames, seconds=seconds, thumbnail=thumbnail,
+                                          rendition_state=rendition_state)
+        self.save()
+
+    def rendition_state(self, index):
+        # None for a chunk rendered before its state was recorded; the next
+        # chunk then warms its renditions up instead.
+        return self.data["chunks"][index].get("rendition_state")
+
+    def thumbnail_scores(self):
+        return [chunk.get("thumbnail") for chunk in self.data["chunks"]]
+
+    def chunk_paths(self):
+        return [self.chunk_path(i) for i in range(len(self.data["chunks"]))]
+
+    def save(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
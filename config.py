@@ -24,12 +24,122 @@ INTRO_TEXTS = [
 ZOOM_INTENSITY = (1.05, 1.3)
 SHAKE_INTENSITY = (2, 8)
 SPEED_VARIATIONS = [0.5, 0.75, 1.0, 1.25, 1.5]
+VIGNETTE_STRENGTH = 0.3
+# Glow and background blur are computed at up to 1/BLUR_DOWNSCALE resolution
+# (a power of two). 1 blurs at full resolution; higher is faster but softer.
+BLUR_DOWNSCALE = 4
 
+EFFECT_CHANCE = 0.02
+EFFECT_DURATION = (5, 20)
+CAPTION_CHANCE = 0.01
+CAPTION_DURATION = (30, 90)
+GRADE_CHANGE_CHANCE = 0.1
+
+# "torch" runs DETECTION_MODEL through ultralytics. "onnx" (which also runs
+# int8 models) and "openvino" run an exported copy on the CPU; create it
+# with `python -m detector_backends export`.
+DETECTION_BACKEND = "torch"
+DETECTION_MODEL = "yolov8n.pt"
+DETECTION_ONNX_MODEL = "yolov8n.onnx"
+DETECTION_OPENVINO_MODEL = os.path.join("yolov8n_openvino_model", "yolov8n.xml")
+DETECTION_IMAGE_SIZE = 640
+DETECTION_NMS_IOU = 0.7
 DETECTION_CONFIDENCE = 0.5
 PERSON_CLASS_ID = 0
 
 USE_GPU = True
 
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY")
+VIDEO_CODEC = "libx264"
+AUDIO_CODEC = "aac"
+ENCODER_PRESET = "medium"
+
+# By default the whole video is sped up or slowed down with
+# SPEED_CHANGE_CHANCE. Set SPEED_SEGMENT_DURATION to a (min, max) frame
+# range, e.g. (30, 90), to split it into segments that each change with that
+# chance instead. Changes ease over SPEED_RAMP_FRAMES frames.
+SPEED_CHANGE_CHANCE = 0.3
+SPEED_SEGMENT_DURATION = None
+SPEED_RAMP_FRAMES = 12
+
+DECODER_THREADS = 0
+
+PIPELINE_QUEUE_SIZE = 8
+# Only the onnx backend runs inference from several workers at once. The
+# torch and openvino backends share one model (or infer request) behind a
+# lock, so extra workers there only overlap batching, cache lookups and
+# queue hand-offs with inference. With tracking on, a single worker runs.
+DETECTION_WORKERS = 1
+DETECTION_BATCH_SIZE = 8
+
+DETECTION_INTERVAL = 3
+TRACKING_ENABLED = True
+DETECTION_INTERVAL_MIN = 1
+DETECTION_INTERVAL_MAX = 30
+TRACKER_IOU_THRESHOLD = 0.3
+TRACKER_MAX_MISSES = 2
+TRACKER_MIN_HITS = 3
+SCENE_CUT_THRESHOLD = 40.0
+SCENE_MOTION_THRESHOLD = 12.0
+
+TEXT_SPRITE_CACHE_SIZE = 256
+# Outlined caption sprites are cached without colour and keep the blended
+# colours of this many (colour, outline colour) pairs each.
+TEXT_SPRITE_TINTS = 8
+# Person label tags are cached per (text, colour, scale); confidence labels
+# alone give about 100 texts per colour.
+LABEL_SPRITE_CACHE_SIZE = 1024
+TEXT_ANIMATION_STEPS = 5
+# Caption outlines scale with the overlay (3 px at source size) up to this.
+TEXT_OUTLINE_MAX_WIDTH = 6
+
+SEGMENT_MIN_SECONDS = 10
+
+# Videos at least two chunks long are rendered in CHECKPOINT_CHUNK_SECONDS
+# chunks tracked in CHECKPOINT_DIR, so an interrupted render resumes.
+CHECKPOINT_ENABLED = True
+CHECKPOINT_CHUNK_SECONDS = 60
+CHECKPOINT_DIR = os.path.join(TEMP_DIR, "checkpoints")
+
+# --preview renders a proxy: at most PREVIEW_HEIGHT pixels tall, every
+# PREVIEW_FRAME_STEP-th frame, encoded with a fast preset.
+PREVIEW_HEIGHT = 360
+PREVIEW_FRAME_STEP = 2
+PREVIEW_PRESET = "ultrafast"
+PREVIEW_CRF = 30
+
+# Besides the main cut, a render can write extra renditions from the same
+# decode, detection and effects pass: "vertical", a VERTICAL_SIZE 9:16 cut
+# that follows the main person, and "thumbnail", the frame with the most
+# confident person detection (at most THUMBNAIL_WIDTH wide).
+# Set with --renditions or AUTOYTEDIT_RENDITIONS=vertical,thumbnail.
+RENDITIONS = tuple(name for name in os.environ.get("AUTOYTEDIT_RENDITIONS", "").split(",") if name)
+VERTICAL_SIZE = (1080, 1920)
+VERTICAL_FOLLOW = 0.1
+VERTICAL_PRESET = ENCODER_PRESET
+VERTICAL_CRF = 23
+# Segments rendered in parallel start without the previous segment's crop
+# position, so each replays this much video before its start to find it.
+VERTICAL_WARMUP_SECONDS = 2.0
+THUMBNAIL_WIDTH = 1280
+
+DETECTION_CACHE_ENABLED = True
+DETECTION_CACHE_DIR = os.path.join(TEMP_DIR, "detections")
+
+# --watch keeps workers with a loaded model running and renders every video
+# that lands in INPUT_DIR, tracking jobs in a SQLite queue. Status is served
+# as JSON on SERVICE_STATUS_HOST:SERVICE_STATUS_PORT (0 disables it).
+SERVICE_DB = os.path.join(TEMP_DIR, "queue.sqlite3")
+SERVICE_WORKERS = 1
+SERVICE_POLL_SECONDS = 2.0
+SERVICE_STATUS_HOST = "127.0.0.1"
+SERVICE_STATUS_PORT = 8765
+SERVICE_MAX_ATTEMPTS = 2
+
+PROFILE_ENABLED = os.environ.get("AUTOYTEDIT_PROFILE", "") not in ("", "0")
+PROFILE_DIR = os.path.join(TEMP_DIR, "profiles")
+PROFILE_PROMETHEUS_FILE = os.environ.get("AUTOYTEDIT_PROMETHEUS_FILE")
+
 def get_random_caption():
     return random.choice(CAPTIONS)
 
@@ -42,6 +152,6 @@ def get_random_color():
 def get_random_font():
     return random.choice(FONTS)
 
-os.makedirs(INPUT_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-os.makedirs(TEMP_DIR, exist_ok=True)
\ No newline at end of file
+def ensure_directories():
+    for directory in (INPUT_DIR, OUTPUT_DIR, TEMP_DIR):
+        os.makedirs(directory, exist_ok=True)
\ No newline at end of file
@@ -0,0 +1,226 @@
+import json
+import os
+import re
+import subprocess
+import tempfile
+from fractions import Fraction
+from functools import lru_cache
+import cv2
+import numpy as np
+from config import DECODER_THREADS
+from encoder import get_ffmpeg_binary, get_ffprobe_binary
+
+def _parse_rate(rate):
+    try:
+        value = Fraction(rate)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return value if value > 0 else None
+
+def _probe_with_ffprobe(input_path):
+    ffprobe = get_ffprobe_binary()
+    if ffprobe is None:
+        return None
+    cmd = [
+        ffprobe, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,r_frame_rate,avg_frame_rate,nb_frames,duration:format=duration",
+        "-of", "json", input_path,
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    data = json.loads(result.stdout or b"{}")
+    if not data.get("streams"):
+        return None
+
+    stream = data["streams"][0]
+    fps = _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate"))
+    if fps is None:
+        return None
+    frame_count = int(stream.get("nb_frames") or 0)
+    if frame_count <= 0:
+        duration = float(stream.get("duration") or data.get("format", {}).get("duration") or 0)
+        frame_count = int(round(duration * fps))
+    return {"width": int(stream["width"]), "height": int(stream["height"]), "fps": fps, "frame_count": frame_count}
+
+def _probe_with_opencv(input_path):
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        return None
+    try:
+        # OpenCV reports e.g. 29.97002997; NTSC rates all have a 1001
+        # denominator, so this recovers the exact rational rate.
+        fps = Fraction(cap.get(cv2.CAP_PROP_FPS)).limit_denominator(1001)
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": fps if fps > 0 else Fraction(30),
+            "frame_count": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        }
+    finally:
+        cap.release()
+
+def probe_video(input_path):
+    return _probe_with_ffprobe(input_path) or _probe_with_opencv(input_path)
+
+@lru_cache(maxsize=None)
+def _passthrough_option(ffmpeg):
+    # -fps_mode arrived in ffmpeg 5.1 and deprecates -vsync, which older
+    # builds (a distro ffmpeg 4.x on PATH or in FFMPEG_BINARY) still need.
+    # Builds from git report no release number and take the new option.
+    try:
+        result = subprocess.run([ffmpeg, "-version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return "-fps_mode"
+    match = re.match(r"ffmpeg version n?(\d+)\.(\d+)", result.stdout.decode(errors="replace"))
+    if match and (int(match.group(1)), int(match.group(2))) < (5, 1):
+        return "-vsync"
+    return "-fps_mode"
+
+@lru_cache(maxsize=8)
+def _frame_times(input_path, size, mtime_ns):
+    # Packet timestamps from a demux-only pass (no decoding), sorted into
+    # the order frames come out of the decoder.
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-i", input_path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-",
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    text = result.stdout.decode(errors="replace")
+    base = re.search(r"^#tb 0: (\d+)/(\d+)", text, re.MULTILINE)
+    if result.returncode != 0 or base is None:
+        return None
+    time_base = Fraction(int(base.group(1)), int(base.group(2)))
+    pts = sorted(int(m) for m in re.findall(r"^0,\s*-?\d+,\s*(-?\d+),", text, re.MULTILINE))
+    return [float(p * time_base) for p in pts] or None
+
+def frame_times(input_path):
+    # Presentation time of every frame of the first video stream, in
+    # seconds from the start of the file as -ss and showinfo count them, or
+    # None if ffmpeg cannot list them. Cached per file version, since every
+    # reader that seeks needs them.
+    try:
+        stat = os.stat(input_path)
+    except OSError:
+        return None
+    return _frame_times(os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns)
+
+class FFmpegFrameReader:
+    # Streams bgr24 frames from an ffmpeg subprocess straight into a ring of
+    # preallocated arrays. read() mirrors cv2.VideoCapture.read(), but the
+    # returned array is reused ring_size reads later, so callers must have
+    # let go of it by then.
+    #
+    # For proxies, size=(width, height) has ffmpeg scale the output and
+    # frame_step=n keeps every nth frame; frame_idx still counts source
+    # frames, and fps and frame_count describe the source.
+    def __init__(self, input_path, ring_size=4, start_frame=0, info=None, size=None, frame_step=1):
+        self.input_path = input_path
+        info = info or probe_video(input_path)
+        if info is None:
+            raise OSError(f"Could not read video metadata: {input_path}")
+        self.source_width = info["width"]
+        self.source_height = info["height"]
+        self.width, self.height = size or (self.source_width, self.source_height)
+        self.frame_step = max(1, int(frame_step))
+        self.fps = info["fps"]
+        self.frame_count = info["frame_count"]
+        self.frame_bytes = self.width * self.height * 3
+        self._ring = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(max(2, ring_size))]
+        self._views = [memoryview(buf).cast("B") for buf in self._ring]
+        self._next = 0
+        self.frame_idx = start_frame
+        self.process = None
+        self._open(start_frame)
+
+    def _open(self, start_frame):
+        ffmpeg = get_ffmpeg_binary()
+        cmd = [ffmpeg, "-loglevel", "error", "-nostdin", "-threads", str(DECODER_THREADS)]
+        if start_frame > 0:
+            cmd += ["-ss", f"{self._seek_time(start_frame):.6f}"]
+        cmd += ["-i", self.input_path, "-map", "0:v:0"]
+        filters = []
+        if self.frame_step > 1:
+            filters.append(f"select=not(mod(n\\,{self.frame_step}))")
+        if (self.width, self.height) != (self.source_width, self.source_height):
+            filters.append(f"scale={self.width}:{self.height}")
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        cmd += [
+            "-f", "rawvideo", "-pix_fmt", "bgr24", _passthrough_option(ffmpeg), "passthrough", "-",
+        ]
+        # stderr goes to a file: a pipe nobody drains can fill up on a
+        # damaged input and stall the decoder.
+        self._errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=self._errors, bufsize=0)
+        self.frame_idx = start_frame
+
+    def _seek_time(self, frame_idx):
+        # Aims between the frame and the one before it, so rounding never
+        # skips the target and accurate seeking starts output exactly on
+        # it. With a variable frame rate, frame n is not at n / fps, so the
+        # real timestamps are used whenever ffmpeg can list them.
+        times = frame_times(self.input_path)
+        if times is None or frame_idx >= len(times):
+            return float((frame_idx - 0.5) / self.fps)
+        return (times[frame_idx - 1] + times[frame_idx]) / 2
+
+    def isOpened(self):
+        return self.process is not None
+
+    def seek(self, frame_idx):
+        self.release()
+        self._open(max(0, frame_idx))
+
+    def read(self):
+        if self.process is None:
+            return False, None
+        view = self._views[self._next]
+        got = 0
+        while got < self.frame_bytes:
+            n = self.process.stdout.readinto(view[got:])
+            if not n:
+                break
+            got += n
+        if got < self.frame_bytes:
+            self._finish()
+            return False, None
+
+        frame = self._ring[self._next]
+        self._next = (self._next + 1) % len(self._ring)
+        self.frame_idx += self.frame_step
+        return True, frame
+
+    def _finish(self):
+        returncode = self.process.wait()
+        self._errors.seek(0)
+        errors = self._errors.read().decode(errors="replace").strip()
+        self._close()
+        if returncode != 0 and errors:
+            print(f"Decoder error: {errors}")
+
+    def _close(self):
+        self.process.stdout.close()
+        self._errors.close()
+        self.process = None
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from config import (
+    DETECTION_CACHE_DIR, DETECTION_BACKEND, DETECTION_MODEL, DETECTION_ONNX_MODEL, DETECTION_OPENVINO_MODEL,
+    DETECTION_IMAGE_SIZE, DETECTION_NMS_IOU, DETECTION_CONFIDENCE, PERSON_CLASS_ID,
+    DETECTION_INTERVAL, TRACKING_ENABLED, DETECTION_INTERVAL_MIN, DETECTION_INTERVAL_MAX
+)
+
+_HASH_CHUNK = 4 * 1024 * 1024
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def _model_identity(path):
+    # Model files are keyed by content, so retrained weights saved under the
+    # same name miss. A name that is not a local file (ultralytics fetches
+    # "yolov8n.pt" itself) is keyed by the name alone, so the CLI, batch
+    # workers and the service share a cache whatever directory they run in.
+    if not os.path.isfile(path):
+        return path
+    digest = file_digest(path)
+    weights = os.path.splitext(path)[0] + ".bin"
+    if path.endswith(".xml") and os.path.isfile(weights):
+        digest += "+" + file_digest(weights)
+    return digest
+
+def detection_settings():
+    if TRACKING_ENABLED:
+        interval = f"adaptive:{DETECTION_INTERVAL_MIN}-{DETECTION_INTERVAL_MAX}"
+    else:
+        interval = str(DETECTION_INTERVAL)
+    model_path = {
+        "onnx": DETECTION_ONNX_MODEL,
+        "openvino": DETECTION_OPENVINO_MODEL,
+    }.get(DETECTION_BACKEND, DETECTION_MODEL)
+    # Everything that changes the boxes is part of the key; backends box
+    # slightly differently, so each gets its own cache.
+    return (
+        f"backend={DETECTION_BACKEND};model={_model_identity(model_path)};"
+        f"imgsz={DETECTION_IMAGE_SIZE};iou={DETECTION_NMS_IOU};"
+        f"conf={DETECTION_CONFIDENCE};class={PERSON_CLASS_ID};interval={interval}"
+    )
+
+# A cache is a directory holding generations of two memory-mapped .npy
+# files: index.npy holds (start, count) per frame, with count -1 for frames
+# never detected, and boxes.npy holds the concatenated (M, 6) detections.
+# The file "current" names the live generation. A save writes a new
+# generation next to it and then swaps "current", so the two arrays always
+# change together. The directory name hashes the video content with the
+# detection settings, so changing either just misses and builds a new
+# cache.
+class DetectionCache:
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.boxes = None
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self._new = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def for_video(cls, video_path, cache_dir=DETECTION_CACHE_DIR):
+        key = hashlib.blake2b(digest_size=16)
+        key.update(file_digest(video_path).encode())
+        key.update(detection_settings().encode())
+        return cls(os.path.join(cache_dir, key.hexdigest()))
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, "current")) as f:
+                generation = f.read().strip()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Ignoring unreadable detection cache {self.path}: {e}")
+            return
+        directory = os.path.join(self.path, generation)
+        try:
+            self.index = np.load(os.path.join(directory, "index.npy"), mmap_mode="r")
+            self.boxes = np.load(os.path.join(directory, "boxes.npy"), mmap_mode="r")
+            self.generation = generation
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable detection cache {self.path}: {e}")
+            self.index = None
+            self.boxes = None
+
+    def __len__(self):
+        stored = 0 if self.index is None else int((self.index[:, 1] >= 0).sum())
+        return stored + len(self._new)
+
+    def get(self, frame_idx):
+        with self._lock:
+            detections = self._new.get(frame_idx)
+            if detections is None and self.index is not None and frame_idx < len(self.index):
+                start, count = self.index[frame_idx]
+                if count >= 0:
+                    detections = np.array(self.boxes[start:start + count], dtype=np.float32)
+            if detections is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return detections
+
+    def put(self, frame_idx, detections):
+        with self._lock:
+            self._new[frame_idx] = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+
+    def new_entries(self):
+        with self._lock:
+            return dict(self._new)
+
+    def update(self, entries):
+        for frame_idx, detections in entries.items():
+            self.put(frame_idx, detections)
+
+    def save(self):
+        with self._lock:
+            if not self._new:
+                return False
+            entries = {}
+            if self.index is not None:
+                for frame_idx in np.flatnonzero(self.index[:, 1] >= 0):
+                    start, count = self.index[frame_idx]
+                    entries[int(frame_idx)] = np.array(self.boxes[start:start + count])
+            entries.update(self._new)
+            self.index = None
+            self.boxes = None
+
+            index = np.full((max(entries) + 1, 2), -1, dtype=np.int64)
+            chunks = []
+            offset = 0
+            for frame_idx in sorted(entries):
+                detections = entries[frame_idx]
+                index[frame_idx] = (offset, len(detections))
+                chunks.append(detections)
+                offset += len(detections)
+            boxes = np.concatenate(chunks).astype(np.float32) if offset else np.zeros((0, 6), dtype=np.float32)
+
+            # Both arrays go into a fresh generation and only the pointer
+            # swap publishes them, so an interrupted save leaves the
+            # previous pair in place. The replaced generation is removed;
+            # mappings of it that are still open stay valid.
+            previous = self.generation
+            generation = f"{time.time_ns():x}-{os.getpid()}"
+            directory = os.path.join(self.path, generation)
+            os.makedirs(directory)
+            np.save(os.path.join(directory, "boxes.npy"), boxes)
+            np.save(os.path.join(directory, "index.npy"), index)
+            pointer = os.path.join(self.path, f"current.{generation}.tmp")
+            with open(pointer, "w") as f:
+                f.write(generation)
+            os.replace(pointer, os.path.join(self.path, "current"))
+            if previous is not None and previous != generation:
+                shutil.rmtree(os.path.join(self.path, previous), ignore_errors=True)
+            self._new = {}
+        self._load()
+        return True
@@ -1,54 +1,47 @@
-import cv2
+import threading
 import numpy as np
-import torch
-from config import DETECTION_CONFIDENCE, PERSON_CLASS_ID, USE_GPU
+from config import DETECTION_BACKEND
+from detector_backends import create_backend, empty_detections
 
 class PersonDetector:
-    def __init__(self):
+    def __init__(self, backend=DETECTION_BACKEND, num_threads=None):
+        # The runtime and weights are only loaded by the first detection, so
+        # startup stays fast and renders served from the detection cache
+        # never import torch at all.
         self.model = None
-        self.device = self._get_device()
-        self._load_model()
+        self.backend = backend
+        self.num_threads = num_threads
+        self._loaded = False
+        self._load_lock = threading.Lock()
 
-    def _get_device(self):
-        if USE_GPU and torch.cuda.is_available():
-            print(f"Using GPU: {torch.cuda.get_device_name(0)}")
-            return "cuda"
-        else:
-            print("Using CPU")
-            return "cpu"
+    def ensure_model(self):
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self._load_model()
+                    self._loaded = True
+        return self.model
 
     def _load_model(self):
         try:
-            from ultralytics import YOLO
-            self.model = YOLO("yolov8n.pt")
-            self.model.to(self.device)
-            print("YOLOv8 model loaded successfully")
+            self.model = create_backend(self.backend, num_threads=self.num_threads)
+            print(f"Detection model loaded: {self.model.model_path} ({self.model.name})")
         except Exception as e:
-            print(f"Error loading YOLO model: {e}")
+            print(f"Error loading {self.backend} detection model: {e}")
             self.model = None
 
     def detect(self, frame):
-        if self.model is None:
-            return []
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        if len(frames) == 0 or self.ensure_model() is None:
+            return [empty_detections() for _ in frames]
         
         try:
-            results = self.model(frame, verbose=False, device=self.device)
-            detections = []
-            
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    if cls == PERSON_CLASS_ID and conf >= DETECTION_CONFIDENCE:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        detections.append([x1, y1, x2, y2, conf, cls])
-            
-            return detections
+            return self.model.detect_batch(frames)
         except Exception as e:
             print(f"Detection error: {e}")
-            return []
+            return [empty_detections() for _ in frames]
 
     def get_person_mask(self, frame, detections):
         mask = np.zeros(frame.shape[:2], dtype=np.uint8)
@@ -60,8 +53,9 @@ class PersonDetector:
         return mask
 
     def track_main_person(self, detections):
-        if not detections:
+        if detections is None or len(detections) == 0:
             return None
         
-        largest = max(detections, key=lambda d: (d[2] - d[0]) * (d[3] - d[1]))
-        return largest
\ No newline at end of file
+        detections = np.asarray(detections)
+        areas = (detections[:, 2] - detections[:, 0]) * (detections[:, 3] - detections[:, 1])
+        return detections[int(np.argmax(areas))]
\ No newline at end of file
@@ -0,0 +1,261 @@
+import argparse
+import os
+import threading
+import cv2
+import numpy as np
+from config import (
+    DETECTION_BACKEND, DETECTION_MODEL, DETECTION_ONNX_MODEL, DETECTION_OPENVINO_MODEL,
+    DETECTION_IMAGE_SIZE, DETECTION_CONFIDENCE, DETECTION_NMS_IOU, PERSON_CLASS_ID, USE_GPU
+)
+
+MAX_DETECTIONS = 300
+LETTERBOX_COLOR = 114
+
+def empty_detections():
+    return np.zeros((0, 6), dtype=np.float32)
+
+def letterbox(frames, size):
+    # Resizes each frame to fit size x size keeping its aspect ratio, pads
+    # it centred with grey the way ultralytics does, and returns the NCHW
+    # RGB float blob plus each frame's (scale, pad_x, pad_y).
+    canvas = np.full((len(frames), size, size, 3), LETTERBOX_COLOR, dtype=np.uint8)
+    transforms = []
+    for i, frame in enumerate(frames):
+        h, w = frame.shape[:2]
+        scale = min(size / h, size / w)
+        new_w, new_h = int(round(w * scale)), int(round(h * scale))
+        left = int(round((size - new_w) / 2 - 0.1))
+        top = int(round((size - new_h) / 2 - 0.1))
+        cv2.resize(frame, (new_w, new_h), dst=canvas[i, top:top + new_h, left:left + new_w],
+                   interpolation=cv2.INTER_LINEAR)
+        transforms.append((scale, left, top))
+    # Scaling straight into each RGB plane is about twice as fast as
+    # flipping, transposing and converting the whole canvas.
+    blob = np.empty((len(frames), 3, size, size), dtype=np.float32)
+    for channel in range(3):
+        np.multiply(canvas[..., 2 - channel], np.float32(1 / 255), out=blob[:, channel], casting="unsafe")
+    return blob, transforms
+
+def nms(boxes, scores, iou_threshold):
+    # Greedy NMS over a pairwise IoU matrix; the candidates left after the
+    # confidence filter are few, so the n x n matrix stays small.
+    order = np.argsort(-scores, kind="stable")
+    boxes = boxes[order]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    top_left = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    iou = inter / np.maximum(areas[:, None] + areas[None, :] - inter, 1e-9)
+    keep = np.ones(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if keep[i]:
+            keep[i + 1:] &= iou[i, i + 1:] <= iou_threshold
+    return order[keep]
+
+def postprocess(prediction, transform, frame_shape, conf=DETECTION_CONFIDENCE, iou=DETECTION_NMS_IOU):
+    # prediction is one image's raw YOLOv8 head, (4 + classes, anchors) with
+    # rows cx, cy, w, h and then per-class scores. A box counts as a person
+    # only when person is also its best class, as in ultralytics.
+    person = prediction[4 + PERSON_CLASS_ID]
+    candidates = np.flatnonzero(person >= conf)
+    if len(candidates) == 0:
+        return empty_detections()
+    candidates = candidates[prediction[4:, candidates].argmax(axis=0) == PERSON_CLASS_ID]
+    if len(candidates) == 0:
+        return empty_detections()
+
+    cx, cy, w, h = prediction[:4, candidates]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    scores = person[candidates]
+    keep = nms(boxes, scores, iou)[:MAX_DETECTIONS]
+
+    scale, pad_x, pad_y = transform
+    boxes = (boxes[keep] - (pad_x, pad_y, pad_x, pad_y)) / scale
+    height, width = frame_shape[:2]
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+    detections = np.empty((len(keep), 6), dtype=np.float32)
+    detections[:, :4] = boxes
+    detections[:, 4] = scores[keep]
+    detections[:, 5] = PERSON_CLASS_ID
+    return detections
+
+class TorchBackend:
+    # The original path: ultralytics does its own preprocessing and NMS.
+    name = "torch"
+
+    def __init__(self, model_path=DETECTION_MODEL, num_threads=None):
+        import torch
+        from ultralytics import YOLO
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        if USE_GPU and torch.cuda.is_available():
+            print(f"Using GPU: {torch.cuda.get_device_name(0)}")
+            self.device = "cuda"
+        else:
+            print("Using CPU")
+            self.device = "cpu"
+        self.model_path = model_path
+        self.model = YOLO(model_path)
+        self.model.to(self.device)
+        # The YOLO object keeps its predictor state between calls, so
+        # detection workers take turns on it; batching, caching and queue
+        # hand-offs still run in parallel.
+        self._lock = threading.Lock()
+
+    def detect_batch(self, frames):
+        detections = []
+        with self._lock:
+            results = self.model(list(frames), verbose=False, device=self.device, iou=DETECTION_NMS_IOU)
+            for result in results:
+                data = result.boxes.data
+                keep = (data[:, 5] == PERSON_CLASS_ID) & (data[:, 4] >= DETECTION_CONFIDENCE)
+                detections.append(data[keep].float().cpu().numpy())
+        return detections
+
+class ExportedBackend:
+    # Shared by the runtimes that execute an exported YOLOv8 graph: letterbox
+    # the batch, run it in chunks the graph accepts, decode and NMS in numpy.
+    name = None
+    batch_size = None
+    image_size = DETECTION_IMAGE_SIZE
+
+    def detect_batch(self, frames):
+        blob, transforms = letterbox(frames, self.image_size)
+        step = self.batch_size or len(frames)
+        detections = []
+        for start in range(0, len(frames), step):
+            output = self._infer(blob[start:start + step])
+            for i, prediction in enumerate(output):
+                detections.append(postprocess(prediction, transforms[start + i], frames[start + i].shape))
+        return detections
+
+    def _infer(self, blob):
+        raise NotImplementedError
+
+class OnnxBackend(ExportedBackend):
+    # Also runs int8 models written by `python -m detector_backends quantize`.
+    name = "onnx"
+
+    def __init__(self, model_path=DETECTION_ONNX_MODEL, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Exports without --dynamic have a fixed batch (usually 1).
+        batch, size = model_input.shape[0], model_input.shape[2]
+        self.batch_size = batch if isinstance(batch, int) else None
+        self.image_size = size if isinstance(size, int) else DETECTION_IMAGE_SIZE
+        print(f"ONNX Runtime on CPU, input {self.image_size}px, batch {self.batch_size or 'dynamic'}")
+
+    def _infer(self, blob):
+        # InferenceSession.run may be called from several workers at once.
+        return self.session.run(None, {self.input_name: blob})[0]
+
+class OpenVinoBackend(ExportedBackend):
+    name = "openvino"
+
+    def __init__(self, model_path=DETECTION_OPENVINO_MODEL, num_threads=None):
+        import openvino as ov
+        core = ov.Core()
+        model = core.read_model(model_path)
+        shape = model.input(0).get_partial_shape()
+        self.model_path = model_path
+        self.batch_size = shape[0].get_length() if shape[0].is_static else None
+        self.image_size = shape[2].get_length() if shape[2].is_static else DETECTION_IMAGE_SIZE
+        config = {"INFERENCE_NUM_THREADS": num_threads} if num_threads else {}
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.request = self.compiled.create_infer_request()
+        # One infer request is reused, and it is not safe to share between
+        # detection workers.
+        self._lock = threading.Lock()
+        print(f"OpenVINO on CPU, input {self.image_size}px, batch {self.batch_size or 'dynamic'}")
+
+    def _infer(self, blob):
+        with self._lock:
+            self.request.infer({0: blob})
+            return self.request.get_output_tensor(0).data.copy()
+
+BACKENDS = {
+    "torch": (TorchBackend, DETECTION_MODEL),
+    "onnx": (OnnxBackend, DETECTION_ONNX_MODEL),
+    "openvino": (OpenVinoBackend, DETECTION_OPENVINO_MODEL),
+}
+
+def create_backend(name=DETECTION_BACKEND, model_path=None, num_threads=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown detection backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    backend_class, default_path = BACKENDS[name]
+    model_path = model_path or default_path
+    if name != "torch" and not os.path.isfile(model_path) and not os.path.isdir(model_path):
+        raise FileNotFoundError(f"{model_path} not found; create it with `python -m detector_backends export`")
+    return backend_class(model_path, num_threads=num_threads)
+
+def export_model(weights, output_format, image_size=DETECTION_IMAGE_SIZE, dynamic=False):
+    from ultralytics import YOLO
+    return YOLO(weights).export(format=output_format, imgsz=image_size, dynamic=dynamic)
+
+def quantize_onnx(onnx_path, output_path, calibration_video, frames=64):
+    # Static int8 quantization calibrated on letterboxed frames spread over
+    # a representative video.
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from decoder import FFmpegFrameReader
+    import onnxruntime as ort
+
+    model_input = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0]
+    size = model_input.shape[2] if isinstance(model_input.shape[2], int) else DETECTION_IMAGE_SIZE
+    reader = FFmpegFrameReader(calibration_video, ring_size=2)
+    samples = []
+    try:
+        stride = max(1, reader.frame_count // frames)
+        for i in range(0, max(reader.frame_count, 1), stride):
+            reader.seek(i)
+            ok, frame = reader.read()
+            if not ok or len(samples) >= frames:
+                break
+            samples.append(letterbox([frame], size)[0])
+    finally:
+        reader.release()
+    if not samples:
+        raise ValueError(f"No frames could be read from {calibration_video}")
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(samples)
+
+        def get_next(self):
+            blob = next(self.batches, None)
+            return None if blob is None else {model_input.name: blob}
+
+    quantize_static(onnx_path, output_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    return output_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the detection model for the CPU backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export the ultralytics weights to ONNX or OpenVINO")
+    export.add_argument("--weights", default=DETECTION_MODEL)
+    export.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    export.add_argument("--image-size", type=int, default=DETECTION_IMAGE_SIZE)
+    export.add_argument("--dynamic", action="store_true", help="allow any batch size instead of batch 1")
+    quantize = commands.add_parser("quantize", help="write an int8 copy of an ONNX model")
+    quantize.add_argument("model", help="ONNX model to quantize")
+    quantize.add_argument("output", help="path of the int8 ONNX model")
+    quantize.add_argument("--calibration", required=True, help="video to calibrate activation ranges on")
+    quantize.add_argument("--frames", type=int, default=64, help="calibration frames")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        path = export_model(args.weights, args.format, args.image_size, args.dynamic)
+    else:
+        path = quantize_onnx(args.model, args.output, args.calibration, args.frames)
+    print(f"Model written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import bisect
+import json
+import os
+import random
+from config import (
+    CAPTIONS, INTRO_TEXTS, SPEED_VARIATIONS, SPEED_CHANGE_CHANCE, SPEED_SEGMENT_DURATION,
+    EFFECT_CHANCE, EFFECT_DURATION, CAPTION_CHANCE, CAPTION_DURATION, GRADE_CHANGE_CHANCE
+)
+
+EFFECTS = ["zoom", "shake", "flash", "glow", "chromatic"]
+GRADE_STYLES = ["cinematic", "warm", "cold", "vintage"]
+CAPTION_STYLES = ["normal", "glitch", "animated"]
+INTRO_FRAMES = 60
+
+class EditPlan:
+    def __init__(self, seed, total_frames, width, height, intro, effects, captions, grades, speeds):
+        self.seed = seed
+        self.total_frames = total_frames
+        self.width = width
+        self.height = height
+        self.intro = intro
+        self.effects = effects
+        self.captions = captions
+        self.grades = grades
+        self.speeds = speeds
+        self._effect_starts = [span["start"] for span in effects]
+        self._caption_starts = [span["start"] for span in captions]
+        self._grade_starts = [span["start"] for span in grades]
+        self._speed_starts = [span["start"] for span in speeds]
+
+    @classmethod
+    def generate(cls, seed, total_frames, width, height):
+        # Every section draws from its own stream, so changing how one part
+        # is planned does not reshuffle the others for the same seed.
+        def stream(name):
+            return random.Random(f"{seed}:{name}")
+
+        total_frames = max(int(total_frames), 1)
+        intro = {"text": stream("intro").choice(INTRO_TEXTS), "end": min(INTRO_FRAMES, total_frames)}
+        return cls(
+            seed, total_frames, width, height, intro,
+            cls._plan_effects(stream("effects"), total_frames),
+            cls._plan_captions(stream("captions"), total_frames, width, height),
+            cls._plan_grades(stream("grades"), total_frames),
+            cls._plan_speeds(stream("speed"), total_frames),
+        )
+
+    @staticmethod
+    def _plan_effects(rng, total_frames):
+        effects = []
+        for frame_idx in range(total_frames):
+            if rng.random() < EFFECT_CHANCE:
+                # A new effect cuts short whatever was still running.
+                if effects and effects[-1]["end"] > frame_idx:
+                    effects[-1]["end"] = frame_idx
+                effect = rng.choice(EFFECTS)
+                duration = rng.randint(*EFFECT_DURATION)
+                effects.append({
+                    "start": frame_idx, "end": min(frame_idx + duration, total_frames),
+                    "effect": effect, "duration": duration,
+                })
+        return effects
+
+    @staticmethod
+    def _plan_captions(rng, total_frames, width, height):
+        captions = []
+        frame_idx = 0
+        while frame_idx < total_frames:
+            if rng.random() < CAPTION_CHANCE:
+                duration = rng.randint(*CAPTION_DURATION)
+                captions.append({
+                    "start": frame_idx, "end": min(frame_idx + duration, total_frames),
+                    "text": rng.choice(CAPTIONS),
+                    "position": [rng.randint(50, max(50, width - 300)), rng.randint(height // 2, max(height // 2, height - 100))],
+                    "style": rng.choice(CAPTION_STYLES),
+                })
+                frame_idx += duration
+            else:
+                frame_idx += 1
+        return captions
+
+    @staticmethod
+    def _plan_grades(rng, total_frames):
+        grades = []
+        for frame_idx in range(total_frames):
+            style = rng.choice(GRADE_STYLES) if rng.random() < GRADE_CHANGE_CHANCE else "cinematic"
+            if grades and grades[-1]["style"] == style:
+                grades[-1]["end"] = frame_idx + 1
+            else:
+                grades.append({"start": frame_idx, "end": frame_idx + 1, "style": style})
+        return grades
+
+    @staticmethod
+    def _plan_speeds(rng, total_frames):
+        if SPEED_SEGMENT_DURATION is None:
+            speed = rng.choice(SPEED_VARIATIONS) if rng.random() < SPEED_CHANGE_CHANCE else 1.0
+            return [{"start": 0, "end": total_frames, "speed": speed}]
+        speeds = []
+        frame_idx = 0
+        while frame_idx < total_frames:
+            end = min(frame_idx + rng.randint(*SPEED_SEGMENT_DURATION), total_frames)
+            speed = rng.choice(SPEED_VARIATIONS) if rng.random() < SPEED_CHANGE_CHANCE else 1.0
+            if speeds and speeds[-1]["speed"] == speed:
+                speeds[-1]["end"] = end
+            else:
+                speeds.append({"start": frame_idx, "end": end, "speed": speed})
+            frame_idx = end
+        return speeds
+
+    def _span_at(self, spans, starts, frame_idx):
+        i = bisect.bisect_right(starts, frame_idx) - 1
+        if i >= 0 and frame_idx < spans[i]["end"]:
+            return spans[i]
+        return None
+
+    def effect_at(self, frame_idx):
+        return self._span_at(self.effects, self._effect_starts, frame_idx)
+
+    def caption_at(self, frame_idx):
+        return self._span_at(self.captions, self._caption_starts, frame_idx)
+
+    def grade_at(self, frame_idx):
+        span = self._span_at(self.grades, self._grade_starts, frame_idx)
+        return span["style"] if span is not None else "cinematic"
+
+    def speed_at(self, frame_idx):
+        span = self._span_at(self.speeds, self._speed_starts, frame_idx)
+        return span["speed"] if span is not None else 1.0
+
+    def frame_rng(self, frame_idx, name):
+        # Per-frame choices that depend on what is in the frame (detections,
+        # jitter) come from a generator derived from the frame index alone,
+        # so any frame renders the same regardless of order.
+        return random.Random(f"{self.seed}:{name}:{frame_idx}")
+
+    def to_dict(self):
+        return {
+            "seed": self.seed,
+            "total_frames": self.total_frames,
+            "width": self.width,
+            "height": self.height,
+            "intro": self.intro,
+            "effects": self.effects,
+            "captions": self.captions,
+            "grades": self.grades,
+            "speeds": self.speeds,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["seed"], data["total_frames"], data["width"], data["height"], data["intro"],
+            data["effects"], data["captions"], data["grades"], data["speeds"],
+        )
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+def prepare_plan(total_frames, width, height, seed=None, plan_path=None):
+    # A plan file that already exists is replayed as-is; otherwise a new
+    # plan is generated and, if a path was given, written there for reuse.
+    if plan_path and os.path.isfile(plan_path):
+        plan = EditPlan.load(plan_path)
+        if (plan.total_frames, plan.width, plan.height) != (max(int(total_frames), 1), width, height):
+            print(f"Warning: edit plan {plan_path} was made for a different video")
+        return plan
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    plan = EditPlan.generate(seed, total_frames, width, height)
+    if plan_path:
+        plan.save(plan_path)
+    return plan
@@ -1,108 +1,356 @@
-import cv2
-import numpy as np
 import os
 import random
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, vfx
-from config import INPUT_DIR, OUTPUT_DIR, TEMP_DIR, SPEED_VARIATIONS
+import shutil
+import time
+from config import (
+    INPUT_DIR, OUTPUT_DIR, TEMP_DIR, DETECTION_INTERVAL, TRACKING_ENABLED,
+    DETECTION_CACHE_ENABLED, PROFILE_ENABLED, PROFILE_DIR, PROFILE_PROMETHEUS_FILE,
+    PREVIEW_HEIGHT, PREVIEW_FRAME_STEP, PREVIEW_PRESET, PREVIEW_CRF, ENCODER_PRESET,
+    CHECKPOINT_ENABLED, CHECKPOINT_CHUNK_SECONDS, RENDITIONS, VERTICAL_WARMUP_SECONDS, ensure_directories
+)
+from checkpoint import RenderManifest, chunk_bounds
+from decoder import FFmpegFrameReader, probe_video
+from detection_cache import DetectionCache
 from detector import PersonDetector
+from edit_plan import EditPlan, prepare_plan
+from encoder import FFmpegPipeWriter, concat_segments
+from pipeline import RenderPipeline
+from profiler import Profiler, NULL_PROFILER
+from renditions import open_renditions, join_renditions, rendition_path
+from speed_ramp import SpeedRamp
 from effects import VideoEffects
 from text_overlay import TextOverlay
+from tracker import PersonTracker
 
 class AutoVideoEditor:
-    def __init__(self):
-        self.detector = PersonDetector()
+    def __init__(self, detector=None):
+        self.detector = detector if detector is not None else PersonDetector()
+        self.use_detection_cache = DETECTION_CACHE_ENABLED
+        self.profile = PROFILE_ENABLED
+        self.prometheus_path = PROFILE_PROMETHEUS_FILE
+        self.checkpoint = CHECKPOINT_ENABLED
+        self.renditions = RENDITIONS
         self.effects = VideoEffects()
         self.text_overlay = TextOverlay()
         self.processed_frames = []
 
-    def process_video(self, input_path, output_path):
+    def process_video(self, input_path, output_path, seed=None, plan_path=None, preview=False):
         print(f"Processing: {input_path}")
         
-        cap = cv2.VideoCapture(input_path)
-        if not cap.isOpened():
+        info = probe_video(input_path)
+        if info is None:
             print(f"Error opening video: {input_path}")
             return False
         
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = info["fps"]
+        width, height = info["width"], info["height"]
+        total_frames = info["frame_count"]
         
-        print(f"Video info: {width}x{height} @ {fps}fps, {total_frames} frames")
+        print(f"Video info: {width}x{height} @ {float(fps):.3f}fps ({fps}), {total_frames} frames")
         
-        temp_video = os.path.join(TEMP_DIR, "temp_processed.mp4")
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(temp_video, fourcc, fps, (width, height))
+        chunk_frames = max(1, int(round(CHECKPOINT_CHUNK_SECONDS * fps)))
+        if self.checkpoint and not preview and total_frames >= 2 * chunk_frames:
+            return self._process_checkpointed(input_path, output_path, info, chunk_frames, seed, plan_path)
         
-        frame_idx = 0
-        detection_interval = 3
-        last_detections = []
+        plan = prepare_plan(total_frames, width, height, seed=seed, plan_path=plan_path)
+        self.effects.plan = plan
+        self.text_overlay.plan = plan
+        print(f"Edit plan seed: {plan.seed}")
+        ramp = self._speed_ramp(plan, total_frames)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_idx % detection_interval == 0:
-                last_detections = self.detector.detect(frame)
-            
-            frame = self.effects.process_frame(frame, last_detections, frame_idx, total_frames)
-            frame = self.text_overlay.process_frame(frame, last_detections, frame_idx, total_frames)
-            
-            out.write(frame)
-            frame_idx += 1
-            
-            if frame_idx % 100 == 0:
-                print(f"Processed {frame_idx}/{total_frames} frames ({100*frame_idx/total_frames:.1f}%)")
+        # A preview renders the same plan on a proxy, so an approved preview
+        # is the final render in miniature.
+        scale, frame_step = self._preview_settings(height) if preview else (1.0, 1)
+        out_width, out_height = self._scaled_size(width, height, scale)
+        scale = out_width / width
+        out_fps = fps / frame_step
+        self.effects.scale = scale
+        self.text_overlay.scale = scale
+        if preview:
+            print(f"Preview: {out_width}x{out_height} @ {float(out_fps):.3f}fps")
         
-        cap.release()
-        out.release()
+        profiler = Profiler(input_path) if self.profile else NULL_PROFILER
+        self.effects.profiler = profiler
+        self.text_overlay.profiler = profiler
+        tracker = PersonTracker() if TRACKING_ENABLED else None
+        cache = self._open_cache(input_path)
+        pipeline = RenderPipeline(self.detector, self.effects, self.text_overlay,
+                                  detection_interval=DETECTION_INTERVAL, tracker=tracker, cache=cache,
+                                  profiler=profiler, frame_step=frame_step, box_scale=scale, speed_ramp=ramp)
         
-        print("Adding audio and finalizing...")
-        self._finalize_video(input_path, temp_video, output_path)
+        try:
+            # The decoder reuses its buffers, so its ring must outlast every
+            # frame the pipeline can hold at once.
+            cap = FFmpegFrameReader(input_path, ring_size=pipeline.max_in_flight(), info=info,
+                                    size=(out_width, out_height), frame_step=frame_step)
+        except OSError as e:
+            print(f"Error opening video: {e}")
+            return False
         
-        if os.path.exists(temp_video):
-            os.remove(temp_video)
+        # Encode to a per-job temp file so concurrent jobs never share a path
+        # and a failed render never leaves a truncated file in the output.
+        ensure_directories()
+        temp_path = self._temp_output_path(output_path)
+        # Extra renditions share this pass; previews only show the main cut.
+        names = () if preview else self.renditions
+        temp_paths = {name: self._temp_output_path(rendition_path(output_path, name)) for name in names}
+        audio_tempo = ramp.audio_tempo(fps)
+        out = None
+        try:
+            out = FFmpegPipeWriter(temp_path, out_width, out_height, out_fps, audio_source=input_path,
+                                   audio_tempo=audio_tempo, preset=PREVIEW_PRESET if preview else ENCODER_PRESET,
+                                   crf=PREVIEW_CRF if preview else None)
+            pipeline.renditions = open_renditions(temp_paths, width, height, fps, plan, self.detector,
+                                                  pipeline.rendered_in_flight(), audio_source=input_path,
+                                                  audio_tempo=audio_tempo)
+        except (OSError, ValueError) as e:
+            print(f"Error starting encoder: {e}")
+            if out is not None:
+                out.abort()
+            cap.release()
+            for path in [temp_path] + list(temp_paths.values()):
+                self._remove(path)
+            return False
         
+        try:
+            pipeline.run(cap, out, total_frames)
+            
+            print("Finalizing...")
+            started = profiler.start()
+            out.close()
+            for rendition in pipeline.renditions:
+                rendition.close()
+            profiler.stop("finalize", started)
+            shutil.move(temp_path, output_path)
+            for name, path in temp_paths.items():
+                shutil.move(path, rendition_path(output_path, name))
+        except Exception as e:
+            print(f"Error encoding video: {e}")
+            out.abort()
+            for rendition in pipeline.renditions:
+                rendition.abort()
+            for path in [temp_path] + list(temp_paths.values()):
+                self._remove(path)
+            self._write_profile(profiler, input_path, pipeline.frames_done)
+            return False
+        finally:
+            cap.release()
+        
+        if cache is not None:
+            print(f"Detection cache: {cache.hits} hits, {cache.misses} misses")
+            try:
+                cache.save()
+            except OSError as e:
+                print(f"Error saving detection cache: {e}")
+        
+        self._write_profile(profiler, input_path, pipeline.frames_done)
         print(f"Done! Output saved to: {output_path}")
+        for name in names:
+            print(f"  {name}: {rendition_path(output_path, name)}")
         return True
 
-
-    def _finalize_video(self, original_path, processed_path, output_path):
+    def _process_checkpointed(self, input_path, output_path, info, chunk_frames, seed, plan_path):
+        # Long renders are encoded as fixed-length chunks recorded in a
+        # manifest. Every chunk is rendered on its own (fresh tracker, plan
+        # lookups by frame index, rendition state from the manifest), so a
+        # render resumed after a crash produces the same chunks it would
+        # have without one.
+        width, height, total_frames = info["width"], info["height"], info["frame_count"]
+        ensure_directories()
+        manifest = RenderManifest.for_job(input_path, output_path)
+        saved = manifest.load()
+        if saved is not None and seed is None and plan_path is None:
+            plan = EditPlan.from_dict(saved["plan"])
+        else:
+            plan = prepare_plan(total_frames, width, height, seed=seed, plan_path=plan_path)
+        print(f"Edit plan seed: {plan.seed}")
+        ramp = self._speed_ramp(plan, total_frames)
+        
+        bounds = chunk_bounds(total_frames, chunk_frames)
+        resumed = manifest.begin(plan, bounds, ramp, self.renditions)
+        if resumed:
+            print(f"Resuming from checkpoint: {resumed}/{len(bounds)} chunk(s) already rendered")
+        
+        profiler = Profiler(input_path) if self.profile else NULL_PROFILER
+        self.effects.plan = plan
+        self.text_overlay.plan = plan
+        self.effects.scale = self.text_overlay.scale = 1.0
+        self.effects.profiler = self.text_overlay.profiler = profiler
+        cache = self._open_cache(input_path)
+        frames = 0
         try:
-            original = VideoFileClip(original_path)
-            processed = VideoFileClip(processed_path)
-            
-            if original.audio is not None:
-                final = processed.set_audio(original.audio)
-            else:
-                final = processed
-            
-            if random.random() < 0.3:
-                speed = random.choice(SPEED_VARIATIONS)
-                if speed != 1.0:
-                    final = final.fx(vfx.speedx, speed)
-            
-            final.write_videofile(
-                output_path,
-                codec='libx264',
-                audio_codec='aac',
-                temp_audiofile=os.path.join(TEMP_DIR, 'temp_audio.m4a'),
-                remove_temp=True,
-                verbose=False,
-                logger=None
-            )
-            
-            original.close()
-            processed.close()
-            final.close()
+            for i, (start, end) in enumerate(bounds):
+                if manifest.is_done(i):
+                    continue
+                started = time.time()
+                # The crop position and other rendition state carry over from
+                # the chunk before, as recorded in the manifest.
+                state = manifest.rendition_state(i - 1) if i else None
+                done, thumbnail, state = self.render_segment(input_path, manifest.partial_path(i), start, end, ramp,
+                                                             cache, profiler, self.renditions, state)
+                manifest.complete(i, done, time.time() - started, thumbnail, state)
+                frames += done
+                print(f"Chunk {i + 1}/{len(bounds)} done ({done} frames, {time.time() - started:.1f}s)")
+                if cache is not None:
+                    cache.save()
             
+            print("Finalizing...")
+            started = profiler.start()
+            temp_path = self._temp_output_path(output_path)
+            audio_tempo = ramp.audio_tempo(info["fps"])
+            try:
+                concat_segments(manifest.chunk_paths(), temp_path, os.path.join(manifest.path, "chunks.txt"),
+                                audio_source=input_path, audio_tempo=audio_tempo)
+                join_renditions(self.renditions, manifest.chunk_paths(), output_path, manifest.path,
+                                audio_source=input_path, audio_tempo=audio_tempo,
+                                thumbnail_scores=manifest.thumbnail_scores())
+                shutil.move(temp_path, output_path)
+            finally:
+                self._remove(temp_path)
+            profiler.stop("finalize", started)
         except Exception as e:
-            print(f"Error finalizing video: {e}")
-            import shutil
-            shutil.copy(processed_path, output_path)
+            # The manifest and finished chunks stay, so rerunning resumes.
+            print(f"Error encoding video: {e}")
+            self._write_profile(profiler, input_path, frames)
+            return False
+        
+        manifest.remove()
+        if cache is not None:
+            print(f"Detection cache: {cache.hits} hits, {cache.misses} misses")
+        self._write_profile(profiler, input_path, frames)
+        print(f"Done! Output saved to: {output_path}")
+        for name in self.renditions:
+            print(f"  {name}: {rendition_path(output_path, name)}")
+        return True
+
+    def _speed_ramp(self, plan, total_frames):
+        ramp = SpeedRamp.from_plan(plan)
+        if not ramp.constant:
+            print(f"Speed ramps: {total_frames} source frames -> {ramp.output_frames(total_frames)} output frames")
+        return ramp
+
+    def _write_profile(self, profiler, input_path, frames):
+        if not profiler.enabled:
+            return
+        profiler.gauge("frame_pool_bytes", self.effects.pool.nbytes() + self.text_overlay.pool.nbytes())
+        report = profiler.report(frames)
+        name = os.path.splitext(os.path.basename(input_path))[0]
+        path = os.path.join(PROFILE_DIR, f"{name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        try:
+            profiler.write_json(path, report)
+            print(f"Profile written to {path}")
+            if self.prometheus_path:
+                profiler.write_prometheus(self.prometheus_path, report)
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+
+    def _preview_settings(self, height):
+        return min(1.0, PREVIEW_HEIGHT / height), PREVIEW_FRAME_STEP
+
+    def _scaled_size(self, width, height, scale):
+        # libx264 with yuv420p needs even dimensions.
+        if scale == 1.0:
+            return width, height
+        return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+    def _temp_output_path(self, output_path):
+        # Reserved with a plain exclusive open rather than mkstemp, whose
+        # 0600 mode would follow the file into output/ on the final move.
+        name, ext = os.path.splitext(os.path.basename(output_path))
+        while True:
+            path = os.path.join(TEMP_DIR, f"{name}_{os.urandom(4).hex()}{ext}")
+            try:
+                with open(path, "xb"):
+                    return path
+            except FileExistsError:
+                continue
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _open_cache(self, input_path):
+        if not self.use_detection_cache:
+            return None
+        try:
+            return DetectionCache.for_video(input_path)
+        except OSError as e:
+            print(f"Detection cache disabled: {e}")
+            return None
+
+    def render_segment(self, input_path, segment_path, start_frame, end_frame, speed_ramp=None, cache=None,
+                       profiler=NULL_PROFILER, renditions=(), rendition_state=None):
+        # Renders frames [start_frame, end_frame) to a video-only file, and
+        # each extra rendition to a file next to it; the audio is muxed once
+        # when the segments are joined. rendition_state is what the previous
+        # segment returned; without it the renditions are warmed up on the
+        # frames before start_frame. Returns the number of frames, the score
+        # of the segment's thumbnail, if one was rendered, and the
+        # renditions' state after the last frame.
+        tracker = PersonTracker() if TRACKING_ENABLED else None
+        pipeline = RenderPipeline(self.detector, self.effects, self.text_overlay,
+                                  detection_interval=DETECTION_INTERVAL, tracker=tracker, cache=cache,
+                                  profiler=profiler, speed_ramp=speed_ramp)
+        cap = FFmpegFrameReader(input_path, ring_size=pipeline.max_in_flight(), start_frame=start_frame)
+        try:
+            out = FFmpegPipeWriter(segment_path, cap.width, cap.height, cap.fps)
+            try:
+                pipeline.renditions = open_renditions({name: rendition_path(segment_path, name) for name in renditions},
+                                                      cap.width, cap.height, cap.fps, self.effects.plan, self.detector,
+                                                      pipeline.rendered_in_flight())
+                if rendition_state is not None:
+                    for rendition in pipeline.renditions:
+                        if rendition.name in rendition_state:
+                            rendition.restore(rendition_state[rendition.name])
+                elif start_frame > 0 and any(rendition.state() is not None for rendition in pipeline.renditions):
+                    self._warm_up_renditions(input_path, start_frame, pipeline.renditions, speed_ramp, cache, cap.fps)
+                pipeline.run(cap, out, cap.frame_count, start_frame=start_frame, end_frame=end_frame)
+                out.close()
+                for rendition in pipeline.renditions:
+                    rendition.close()
+            except Exception:
+                out.abort()
+                for rendition in pipeline.renditions:
+                    rendition.abort()
+                raise
+        finally:
+            cap.release()
+        thumbnail = next((rendition.score for rendition in pipeline.renditions if rendition.name == "thumbnail"), None)
+        state = {rendition.name: rendition.state() for rendition in pipeline.renditions
+                 if rendition.state() is not None}
+        return pipeline.frames_done, thumbnail, state
+
+    def _warm_up_renditions(self, input_path, start_frame, renditions, speed_ramp, cache, fps):
+        # Feeds the renditions the detections of the VERTICAL_WARMUP_SECONDS
+        # before start_frame the way the render stage would have, carried
+        # forward between detection runs. With VERTICAL_FOLLOW easing, the
+        # crop then starts within a pixel or two of where one pass over the
+        # whole video would have it.
+        first = max(0, start_frame - int(round(VERTICAL_WARMUP_SECONDS * fps)))
+        cap = FFmpegFrameReader(input_path, start_frame=first)
+        last_detections = []
+        try:
+            for frame_idx in range(first, start_frame):
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                if frame_idx % DETECTION_INTERVAL == 0:
+                    detections = cache.get(frame_idx) if cache is not None else None
+                    if detections is None:
+                        detections = self.detector.detect(frame)
+                        if cache is not None and self.detector.model is not None:
+                            cache.put(frame_idx, detections)
+                    last_detections = detections
+                if speed_ramp is None or speed_ramp.repeats(frame_idx):
+                    for rendition in renditions:
+                        rendition.warm_up(last_detections)
+        finally:
+            cap.release()
 
     def add_transitions(self, clips):
+        from moviepy.editor import concatenate_videoclips
         if len(clips) < 2:
             return clips[0] if clips else None
         
@@ -114,49 +362,32 @@ class AutoVideoEditor:
         
         return concatenate_videoclips(final_clips, method="compose")
 
-    def apply_random_speed_ramps(self, clip):
-        duration = clip.duration
-        if duration < 3:
-            return clip
-        
-        segments = []
-        current_time = 0
-        
-        while current_time < duration:
-            segment_duration = min(random.uniform(1, 3), duration - current_time)
-            segment = clip.subclip(current_time, current_time + segment_duration)
-            
-            if random.random() < 0.2:
-                speed = random.choice([0.5, 0.75, 1.25, 1.5])
-                segment = segment.fx(vfx.speedx, speed)
-            
-            segments.append(segment)
-            current_time += segment_duration
-        
-        return concatenate_videoclips(segments)
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
 
-def process_all_videos():
-    editor = AutoVideoEditor()
-    
-    video_extensions = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.flv', '.webm')
-    
-    input_files = [f for f in os.listdir(INPUT_DIR) if f.lower().endswith(video_extensions)]
+def output_path_for(input_path, preview=False):
+    name, ext = os.path.splitext(os.path.basename(input_path))
+    if preview:
+        return os.path.join(OUTPUT_DIR, f"{name}_preview.mp4")
+    return os.path.join(OUTPUT_DIR, f"{name}_edited{ext}")
+
+def find_input_videos(preview=False):
+    input_files = sorted(f for f in os.listdir(INPUT_DIR) if f.lower().endswith(VIDEO_EXTENSIONS))
+    return [(os.path.join(INPUT_DIR, f), output_path_for(f, preview)) for f in input_files]
+
+def process_all_videos(editor=None, preview=False):
+    ensure_directories()
+    jobs = find_input_videos(preview)
     
-    if not input_files:
+    if not jobs:
         print(f"No video files found in {INPUT_DIR}/")
         print("Please add video files to the input folder and run again.")
         return
     
-    print(f"Found {len(input_files)} video(s) to process")
+    editor = editor or AutoVideoEditor()
+    print(f"Found {len(jobs)} video(s) to process")
     
-    for filename in input_files:
-        input_path = os.path.join(INPUT_DIR, filename)
-        
-        name, ext = os.path.splitext(filename)
-        output_filename = f"{name}_edited{ext}"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        editor.process_video(input_path, output_path)
+    for input_path, output_path in jobs:
+        editor.process_video(input_path, output_path, preview=preview)
         
         editor.effects = VideoEffects()
         editor.text_overlay = TextOverlay()
@@ -1,127 +1,210 @@
 import cv2
 import numpy as np
 import random
-from config import ZOOM_INTENSITY, SHAKE_INTENSITY, get_random_color
+from config import ZOOM_INTENSITY, SHAKE_INTENSITY, VIGNETTE_STRENGTH, BLUR_DOWNSCALE, get_random_color
+from edit_plan import EditPlan, EFFECTS
+from frame_pool import FramePool
+from profiler import NULL_PROFILER
+
+def _channel_lut(scales, offset=0.0):
+    # One 256-entry table per BGR channel, laid out for cv2.LUT.
+    values = np.arange(256, dtype=np.float64)[:, None] * np.asarray(scales, dtype=np.float64) + offset
+    return np.clip(values, 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
+GRADE_LUTS = {
+    "cinematic": np.clip(np.round(np.arange(256) * 1.1 + 10), 0, 255).astype(np.uint8),
+    "warm": _channel_lut([1.0, 1.0, 1.1]),
+    "cold": _channel_lut([1.1, 1.0, 1.0]),
+    "vintage": _channel_lut([0.8, 0.9, 1.0]),
+}
+
+class FramePrecompute:
+    def __init__(self, height, width):
+        self.height = height
+        self.width = width
+        self.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self.lab = np.empty((height, width, 3), dtype=np.uint8)
+        self.lightness = np.empty((height, width), dtype=np.uint8)
+        self._vignettes = {}
+
+    def vignette(self, strength):
+        mask = self._vignettes.get(strength)
+        if mask is None:
+            y, x = np.ogrid[:self.height, :self.width]
+            dist = np.sqrt((x - self.width // 2) ** 2 + (y - self.height // 2) ** 2)
+            scale = 1 - dist / max(dist.max(), 1.0) * strength
+            # 8-bit fixed point, applied with cv2.multiply(scale=1/255).
+            mask = np.round(np.clip(scale, 0, 1) * 255).astype(np.uint8)
+            mask = cv2.merge([mask] * 3)
+            self._vignettes[strength] = mask
+        return mask
 
 class VideoEffects:
-    def __init__(self):
-        self.shake_offset_x = 0
-        self.shake_offset_y = 0
-        self.zoom_factor = 1.0
-        self.target_zoom = 1.0
-        self.current_effect = None
-        self.effect_duration = 0
-        self.effect_frame = 0
-
-    def apply_zoom(self, frame, factor):
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.pool = FramePool()
+        self.profiler = NULL_PROFILER
+        # Pixel sizes in the plan and below are for the source resolution;
+        # proxy renders set this to their fraction of it.
+        self.scale = 1.0
+        self._precomputed = {}
+
+    def precompute(self, frame):
+        h, w = frame.shape[:2]
+        pre = self._precomputed.get((h, w))
+        if pre is None:
+            pre = self._precomputed[(h, w)] = FramePrecompute(h, w)
+        return pre
+
+    def apply_zoom(self, frame, factor, out=None):
         h, w = frame.shape[:2]
         new_h, new_w = int(h / factor), int(w / factor)
         y1 = (h - new_h) // 2
         x1 = (w - new_w) // 2
         cropped = frame[y1:y1+new_h, x1:x1+new_w]
-        return cv2.resize(cropped, (w, h), interpolation=cv2.INTER_LINEAR)
+        return cv2.resize(cropped, (w, h), dst=out, interpolation=cv2.INTER_LINEAR)
 
-    def apply_shake(self, frame, intensity):
+    def apply_shake(self, frame, intensity, rng=random, out=None):
         h, w = frame.shape[:2]
-        dx = random.randint(-intensity, intensity)
-        dy = random.randint(-intensity, intensity)
+        dx = rng.randint(-intensity, intensity)
+        dy = rng.randint(-intensity, intensity)
         M = np.float32([[1, 0, dx], [0, 1, dy]])
-        return cv2.warpAffine(frame, M, (w, h), borderMode=cv2.BORDER_REFLECT)
-
-    def apply_flash(self, frame, intensity=0.5):
-        flash = np.ones_like(frame) * 255
-        return cv2.addWeighted(frame, 1 - intensity, flash, intensity, 0)
+        return cv2.warpAffine(frame, M, (w, h), dst=out, borderMode=cv2.BORDER_REFLECT)
 
-    def apply_vignette(self, frame, strength=0.5):
-        h, w = frame.shape[:2]
-        x = np.arange(w)
-        y = np.arange(h)
-        X, Y = np.meshgrid(x, y)
-        cx, cy = w // 2, h // 2
-        mask = np.sqrt((X - cx)**2 + (Y - cy)**2)
-        mask = mask / mask.max()
-        mask = 1 - mask * strength
-        mask = np.dstack([mask] * 3)
-        return (frame * mask).astype(np.uint8)
-
-
-    def apply_color_grade(self, frame, style="cinematic"):
-        if style == "cinematic":
-            lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            l = clahe.apply(l)
-            lab = cv2.merge([l, a, b])
-            frame = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-            frame = cv2.addWeighted(frame, 1.1, np.zeros_like(frame), 0, 10)
-        elif style == "warm":
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame[:, :, 0] = np.clip(frame[:, :, 0] * 1.1, 0, 255)
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        elif style == "cold":
-            frame[:, :, 0] = np.clip(frame[:, :, 0] * 1.1, 0, 255)
-        elif style == "vintage":
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = np.clip(frame * [1.0, 0.9, 0.8], 0, 255).astype(np.uint8)
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        return frame
+    def apply_flash(self, frame, intensity=0.5, out=None):
+        # Blending towards white is frame * (1 - i) + 255 * i, a scalar op.
+        return cv2.convertScaleAbs(frame, dst=out, alpha=1 - intensity, beta=255 * intensity)
 
-    def apply_blur_background(self, frame, mask):
-        blurred = cv2.GaussianBlur(frame, (21, 21), 0)
-        mask_3ch = np.dstack([mask] * 3)
-        return np.where(mask_3ch > 0, frame, blurred)
+    def apply_vignette(self, frame, strength=0.5, out=None):
+        mask = self.precompute(frame).vignette(strength)
+        return cv2.multiply(frame, mask, dst=out, scale=1 / 255)
 
-    def apply_glow(self, frame, intensity=0.3):
-        blurred = cv2.GaussianBlur(frame, (0, 0), 30)
-        return cv2.addWeighted(frame, 1, blurred, intensity, 0)
+    def apply_color_grade(self, frame, style="cinematic", out=None):
+        lut = GRADE_LUTS.get(style)
+        if lut is None:
+            return frame
+        if style == "cinematic":
+            pre = self.precompute(frame)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2LAB, dst=pre.lab)
+            cv2.extractChannel(pre.lab, 0, dst=pre.lightness)
+            pre.clahe.apply(pre.lightness, dst=pre.lightness)
+            cv2.insertChannel(pre.lightness, pre.lab, 0)
+            frame = cv2.cvtColor(pre.lab, cv2.COLOR_LAB2BGR, dst=out)
+        return cv2.LUT(frame, lut, dst=out)
+
+    def apply_finish(self, frame, style="cinematic", vignette_strength=VIGNETTE_STRENGTH, out=None):
+        # Vignette and grade run on every frame, so they are fused into one
+        # pass over precomputed tables. By default the frame is overwritten
+        # in place; pass out= to write into another preallocated buffer.
+        if out is None:
+            out = frame
+        self.apply_vignette(frame, vignette_strength, out=out)
+        return self.apply_color_grade(out, style, out=out)
+
+    def blur(self, frame, sigma, downscale=None, out=None):
+        # Wide blurs are low-frequency, so they are computed on an image
+        # pyramid: pyrDown to at most 1/downscale (never coarser than the
+        # blur radius), blur with the remaining sigma, then upsample. Each
+        # pyrDown already blurs by one pixel of variance per level.
+        downscale = BLUR_DOWNSCALE if downscale is None else downscale
+        levels = 0
+        while 2 ** (levels + 1) <= min(downscale, sigma):
+            levels += 1
+        if levels == 0:
+            return cv2.GaussianBlur(frame, (0, 0), sigma, dst=out)
 
-    def apply_chromatic_aberration(self, frame, offset=3):
-        b, g, r = cv2.split(frame)
         h, w = frame.shape[:2]
-        M_left = np.float32([[1, 0, -offset], [0, 1, 0]])
-        M_right = np.float32([[1, 0, offset], [0, 1, 0]])
-        r = cv2.warpAffine(r, M_right, (w, h))
-        b = cv2.warpAffine(b, M_left, (w, h))
-        return cv2.merge([b, g, r])
+        small = frame
+        for level in range(levels):
+            sh, sw = small.shape[:2]
+            small = cv2.pyrDown(small, dst=self.pool.buffer(f"pyramid_{level}", ((sh + 1) // 2, (sw + 1) // 2) + frame.shape[2:]))
+        residual = max(sigma ** 2 - (4 ** levels - 1) / 3, 0) ** 0.5 / 2 ** levels
+        if residual > 0.3:
+            cv2.GaussianBlur(small, (0, 0), residual, dst=small)
+        return cv2.resize(small, (w, h), dst=out, interpolation=cv2.INTER_LINEAR)
+
+    def apply_blur_background(self, frame, mask, out=None):
+        # sigma 3.5 is what a 21x21 kernel with sigma=0 resolves to.
+        blurred = self.blur(frame, 3.5, out=out)
+        cv2.copyTo(frame, mask, blurred)
+        return blurred
+
+    def apply_glow(self, frame, intensity=0.3, out=None, sigma=30):
+        blurred = self.blur(frame, sigma, out=self.pool.like("glow", frame))
+        return cv2.addWeighted(frame, 1, blurred, intensity, 0, dst=out)
+
+    def apply_chromatic_aberration(self, frame, offset=3, out=None):
+        # Red moves right and blue moves left with black fill, written
+        # channel by channel into the destination instead of split/merge.
+        if out is None:
+            out = np.empty_like(frame)
+        w = frame.shape[1]
+        offset = min(max(offset, 0), w)
+        if offset == 0:
+            np.copyto(out, frame)
+            return out
+        out[:, :, 1] = frame[:, :, 1]
+        out[:, offset:, 2] = frame[:, :w - offset, 2]
+        out[:, :offset, 2] = 0
+        out[:, :w - offset, 0] = frame[:, offset:, 0]
+        out[:, w - offset:, 0] = 0
+        return out
 
     def apply_speed_ramp(self, speed_factor):
         return max(0.25, min(2.0, speed_factor))
 
     def get_random_effect(self):
-        effects = ["zoom", "shake", "flash", "glow", "chromatic"]
-        return random.choice(effects)
-
-    def process_frame(self, frame, detections=None, frame_idx=0, total_frames=1):
-        if random.random() < 0.02:
-            self.current_effect = self.get_random_effect()
-            self.effect_duration = random.randint(5, 20)
-            self.effect_frame = 0
-
-        if self.current_effect and self.effect_frame < self.effect_duration:
-            if self.current_effect == "zoom":
-                factor = 1.0 + (ZOOM_INTENSITY[1] - 1.0) * (self.effect_frame / self.effect_duration)
-                frame = self.apply_zoom(frame, min(factor, ZOOM_INTENSITY[1]))
-            elif self.current_effect == "shake":
-                intensity = int(SHAKE_INTENSITY[0] + (SHAKE_INTENSITY[1] - SHAKE_INTENSITY[0]) * random.random())
-                frame = self.apply_shake(frame, intensity)
-            elif self.current_effect == "flash":
-                intensity = max(0, 0.5 - (self.effect_frame / self.effect_duration) * 0.5)
-                frame = self.apply_flash(frame, intensity)
-            elif self.current_effect == "glow":
-                frame = self.apply_glow(frame, 0.4)
-            elif self.current_effect == "chromatic":
-                frame = self.apply_chromatic_aberration(frame, 5)
-            self.effect_frame += 1
-        else:
-            self.current_effect = None
+        return random.choice(EFFECTS)
+
+    def ensure_plan(self, frame, total_frames):
+        if self.plan is None:
+            h, w = frame.shape[:2]
+            self.plan = EditPlan.generate(random.randrange(2 ** 32), total_frames, w, h)
+        return self.plan
+
+    def process_frame(self, frame, detections=None, frame_idx=0, total_frames=1, out=None):
+        # Each step reads one buffer and writes another: the frame, then two
+        # pooled scratch frames in turn, and the fused finish writes the
+        # result back into `out` (the frame itself by default). The chain
+        # therefore allocates nothing once the pool is warm.
+        plan = self.ensure_plan(frame, total_frames)
+        effect = plan.effect_at(frame_idx)
+        spare = (self.pool.like("effect_a", frame), self.pool.like("effect_b", frame))
+        src = frame
+        rng = None
+
+        if effect is not None:
+            started = self.profiler.start()
+            name = effect["effect"]
+            progress = (frame_idx - effect["start"]) / effect["duration"]
+            dst = spare[0]
+            if name == "zoom":
+                factor = 1.0 + (ZOOM_INTENSITY[1] - 1.0) * progress
+                src = self.apply_zoom(src, min(factor, ZOOM_INTENSITY[1]), out=dst)
+            elif name == "shake":
+                rng = plan.frame_rng(frame_idx, "effects")
+                intensity = int(SHAKE_INTENSITY[0] + (SHAKE_INTENSITY[1] - SHAKE_INTENSITY[0]) * rng.random())
+                intensity = int(round(intensity * self.scale))
+                src = self.apply_shake(src, intensity, rng, out=dst)
+            elif name == "flash":
+                intensity = max(0, 0.5 - progress * 0.5)
+                src = self.apply_flash(src, intensity, out=dst)
+            elif name == "glow":
+                src = self.apply_glow(src, 0.4, out=dst, sigma=30 * self.scale)
+            elif name == "chromatic":
+                src = self.apply_chromatic_aberration(src, int(round(5 * self.scale)), out=dst)
+            self.profiler.stop(f"effect.{name}", started)
 
         if detections is not None and len(detections) > 0:
-            if random.random() < 0.3:
-                frame = self.apply_zoom(frame, random.uniform(1.05, 1.15))
-
-        frame = self.apply_vignette(frame, 0.3)
-        
-        styles = ["cinematic", "warm", "cold", "vintage"]
-        frame = self.apply_color_grade(frame, random.choice(styles) if random.random() < 0.1 else "cinematic")
-
-        return frame
\ No newline at end of file
+            rng = rng or plan.frame_rng(frame_idx, "effects")
+            if rng.random() < 0.3:
+                started = self.profiler.start()
+                dst = spare[1] if src is spare[0] else spare[0]
+                src = self.apply_zoom(src, rng.uniform(1.05, 1.15), out=dst)
+                self.profiler.stop("effect.detection_zoom", started)
+
+        started = self.profiler.start()
+        style = plan.grade_at(frame_idx)
+        frame = self.apply_finish(src, style, VIGNETTE_STRENGTH, out=frame if out is None else out)
+        self.profiler.stop(f"grade.{style}", started)
+        return frame
@@ -0,0 +1,213 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from config import FFMPEG_BINARY, VIDEO_CODEC, AUDIO_CODEC, ENCODER_PRESET
+
+def get_ffmpeg_binary():
+    if FFMPEG_BINARY:
+        return FFMPEG_BINARY
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return "ffmpeg"
+
+def get_ffprobe_binary():
+    ffmpeg = get_ffmpeg_binary()
+    directory, name = os.path.split(ffmpeg)
+    if directory and "ffmpeg" in name:
+        candidate = os.path.join(directory, name.replace("ffmpeg", "ffprobe", 1))
+        if os.path.isfile(candidate):
+            return candidate
+    return shutil.which("ffprobe")
+
+def find_keyframes(input_path):
+    # Decoding only keyframes through showinfo is fast and needs nothing
+    # beyond the ffmpeg binary we already encode with.
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "info",
+        "-skip_frame", "nokey", "-i", input_path,
+        "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-",
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    times = re.findall(r"pts_time:\s*(-?[0-9.]+)", result.stderr.decode(errors="replace"))
+    return sorted(float(t) for t in times)
+
+def has_audio(input_path):
+    # ffmpeg lists the input's streams on stderr even with no output given.
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", input_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return False
+    return re.search(r"Stream #\S+.*: Audio:", result.stderr.decode(errors="replace")) is not None
+
+def _atempo(tempo):
+    # Older builds accept 0.5-2.0 per atempo instance, so larger changes
+    # are chained.
+    if abs(tempo - 1.0) < 1e-9:
+        return "anull"
+    filters = []
+    while tempo > 2.0:
+        filters.append("atempo=2.0")
+        tempo /= 2.0
+    while tempo < 0.5:
+        filters.append("atempo=0.5")
+        tempo /= 0.5
+    filters.append(f"atempo={tempo:.9f}")
+    return ",".join(filters)
+
+def audio_args(audio_source, audio_tempo, input_index=1):
+    # audio_tempo is a list of (start_seconds, end_seconds, tempo) pieces
+    # covering the source audio. The stream is cut at each start, every
+    # piece is stretched by its own tempo and the pieces are joined again,
+    # all inside the mux. atempo loses a few milliseconds at the end of each
+    # piece (how many depends on the audio), so every piece is padded and
+    # trimmed to its exact length and the audio stays on the video's
+    # timeline. Pieces keep their source timestamps out of asegment, which
+    # concat would then offset a second time, so each one restarts at zero.
+    # The last piece is padded or trimmed to the end of the video, so audio
+    # that runs short never cuts frames the way -shortest would. Without
+    # pieces the audio is muxed as it is.
+    if not audio_tempo or not has_audio(audio_source):
+        return ["-map", f"{input_index}:a:0?", "-c:a", AUDIO_CODEC]
+    stretches = []
+    for i, (start, end, tempo) in enumerate(audio_tempo):
+        duration = (end - start) / tempo
+        stretch = _atempo(tempo)
+        if i == len(audio_tempo) - 1 or stretch != "anull":
+            stretch += f",apad,atrim=duration={duration:.9f}"
+        stretches.append(stretch)
+    source = f"[{input_index}:a:0]asetpts=PTS-STARTPTS"
+    if len(stretches) == 1:
+        graph = f"{source},{stretches[0]}[aout]"
+    else:
+        timestamps = "|".join(f"{start:.9f}" for start, _, _ in audio_tempo[1:])
+        parts = [f"{source},asegment=timestamps={timestamps}" + "".join(f"[s{i}]" for i in range(len(stretches)))]
+        parts += [f"[s{i}]asetpts=PTS-STARTPTS,{stretch}[t{i}]" for i, stretch in enumerate(stretches)]
+        parts.append("".join(f"[t{i}]" for i in range(len(stretches))) + f"concat=n={len(stretches)}:v=0:a=1[aout]")
+        graph = ";".join(parts)
+    return ["-filter_complex", graph, "-map", "[aout]", "-c:a", AUDIO_CODEC]
+
+def concat_segments(segment_paths, output_path, list_path, audio_source=None, audio_tempo=None):
+    with open(list_path, "w") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    # Segments share encoder settings, so the video stream is copied as-is;
+    # only the source audio is encoded, once, over the whole timeline.
+    cmd = [
+        get_ffmpeg_binary(), "-y", "-loglevel", "error", "-nostdin",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+    ]
+    if audio_source is not None:
+        cmd += ["-i", audio_source, "-map", "0:v:0"] + audio_args(audio_source, audio_tempo)
+    cmd += ["-c:v", "copy", output_path]
+
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed with code {result.returncode}: {result.stderr.decode(errors='replace').strip()}")
+    return True
+
+class FFmpegPipeWriter:
+    # Speed changes arrive as already remapped frames; audio_tempo (see
+    # audio_args) stretches the source audio to match in the same mux.
+    def __init__(self, output_path, width, height, fps, audio_source=None, audio_tempo=None, preset=ENCODER_PRESET,
+                 crf=None):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_source = audio_source
+        self.audio_tempo = audio_tempo
+        self.preset = preset
+        self.crf = crf
+        self.frames_written = 0
+        self.process = None
+        self._open()
+
+    def _build_command(self):
+        cmd = [
+            get_ffmpeg_binary(), "-y", "-loglevel", "error", "-nostdin",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{self.width}x{self.height}", "-r", str(self.fps),
+            "-i", "-",
+        ]
+        if self.audio_source is not None:
+            cmd += ["-i", self.audio_source, "-map", "0:v:0"] + audio_args(self.audio_source, self.audio_tempo)
+
+        cmd += ["-r", str(self.fps), "-c:v", VIDEO_CODEC, "-preset", self.preset, "-pix_fmt", "yuv420p"]
+        if self.crf is not None:
+            cmd += ["-crf", str(self.crf)]
+        cmd.append(self.output_path)
+        return cmd
+
+    def _open(self):
+        # stderr goes to a file, as in the decoder: it is only read once
+        # ffmpeg exits, and a pipe left undrained until then can fill up
+        # and stall both sides.
+        self._errors = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self._build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._errors,
+        )
+
+    def write(self, frame):
+        if frame.shape[:2] != (self.height, self.width):
+            raise ValueError(f"Frame size {frame.shape[1]}x{frame.shape[0]} does not match {self.width}x{self.height}")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.process.wait()
+            raise RuntimeError(f"ffmpeg exited early: {self._read_errors()}")
+        self.frames_written += 1
+
+    def _read_errors(self):
+        self._errors.seek(0)
+        return self._errors.read().decode(errors="replace").strip()
+
+    def _close(self):
+        self._errors.close()
+        self.process = None
+
+    def close(self):
+        if self.process is None:
+            return True
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        errors = self._read_errors()
+        self._close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with code {returncode}: {errors}")
+        return True
+
+    def abort(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
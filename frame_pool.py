@@ -0,0 +1,26 @@
+import numpy as np
+
+class FramePool:
+    # Named scratch buffers reused across frames. A buffer is allocated the
+    # first time a (name, shape, dtype) is asked for, so once every effect
+    # has run at a resolution `allocations` stops growing.
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buf = self._buffers.get(key)
+        if buf is None:
+            buf = self._buffers[key] = np.empty(shape, dtype=dtype)
+            self.allocations += 1
+        return buf
+
+    def like(self, name, frame):
+        return self.buffer(name, frame.shape, frame.dtype)
+
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def clear(self):
+        self._buffers = {}
@@ -1,28 +1,97 @@
-import sys
+import argparse
 import os
-from editor import AutoVideoEditor, process_all_videos
-from config import INPUT_DIR, OUTPUT_DIR
+from config import INPUT_DIR, OUTPUT_DIR, ensure_directories
+
+# The editor pulls in OpenCV, numpy and the render stack, so it is imported
+# only once the arguments say there is something to render; --help and
+# invalid invocations return without loading any of it.
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Auto video editor")
+    parser.add_argument("input", nargs="?", help="video to process (default: every video in the input folder)")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="number of videos to render in parallel")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="split a single input video into this many segments rendered in parallel")
+    parser.add_argument("--seed", type=int, help="seed for the edit plan, to reproduce a previous render")
+    parser.add_argument("--plan", help="edit plan JSON to replay, or to write the generated plan to if it does not exist")
+    parser.add_argument("--preview", action="store_true",
+                        help="render a fast low-resolution proxy of the edit (to output/<name>_preview.mp4)")
+    parser.add_argument("--renditions", nargs="+", choices=["vertical", "thumbnail"],
+                        help="also write a 9:16 cut following the main person and/or a best-frame thumbnail "
+                             "from the same render pass (also AUTOYTEDIT_RENDITIONS=vertical,thumbnail)")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and render every video that lands in the input folder (--jobs at once)")
+    parser.add_argument("--port", type=int, help="port of the --watch status server (0 disables it)")
+    parser.add_argument("--status", action="store_true", help="show the --watch job queue and exit")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every stage and write a JSON report per video (also AUTOYTEDIT_PROFILE=1)")
+    parser.add_argument("--prometheus", help="also write the profile in Prometheus text format to this file")
+    return parser.parse_args()
+
+def make_editor(args):
+    from editor import AutoVideoEditor
+    editor = AutoVideoEditor()
+    editor.profile = editor.profile or args.profile or bool(args.prometheus)
+    editor.prometheus_path = args.prometheus or editor.prometheus_path
+    if args.renditions:
+        editor.renditions = tuple(args.renditions)
+    return editor
 
 def main():
+    args = parse_args()
+    if args.status:
+        from service import print_status
+        print_status()
+        return
+    # Batch workers are spawned fresh and read these from the environment.
+    if args.profile or args.prometheus:
+        os.environ["AUTOYTEDIT_PROFILE"] = "1"
+    if args.prometheus:
+        os.environ["AUTOYTEDIT_PROMETHEUS_FILE"] = os.path.abspath(args.prometheus)
+    if args.renditions:
+        os.environ["AUTOYTEDIT_RENDITIONS"] = ",".join(args.renditions)
+    
     print("=" * 50)
     print("AUTO VIDEO EDITOR")
     print("=" * 50)
     print(f"Input folder: {INPUT_DIR}/")
     print(f"Output folder: {OUTPUT_DIR}/")
     print("=" * 50)
+    ensure_directories()
     
-    if len(sys.argv) > 1:
-        input_path = sys.argv[1]
-        if os.path.isfile(input_path):
-            editor = AutoVideoEditor()
-            filename = os.path.basename(input_path)
-            name, ext = os.path.splitext(filename)
-            output_path = os.path.join(OUTPUT_DIR, f"{name}_edited{ext}")
-            editor.process_video(input_path, output_path)
-        else:
+    if args.watch:
+        from config import SERVICE_WORKERS, SERVICE_STATUS_PORT
+        from service import RenderService
+        RenderService(workers=args.jobs if args.jobs > 1 else SERVICE_WORKERS,
+                      port=SERVICE_STATUS_PORT if args.port is None else args.port, preview=args.preview).run()
+    elif args.input:
+        input_path = args.input
+        if not os.path.isfile(input_path):
             print(f"File not found: {input_path}")
+            return
+        from editor import output_path_for
+        output_path = output_path_for(input_path, args.preview)
+        if args.segments > 1 and not args.preview:
+            from batch import run_segmented
+            from config import RENDITIONS
+            run_segmented(input_path, output_path, args.segments, seed=args.seed, plan_path=args.plan,
+                          renditions=tuple(args.renditions or RENDITIONS))
+        else:
+            editor = make_editor(args)
+            editor.process_video(input_path, output_path, seed=args.seed, plan_path=args.plan, preview=args.preview)
+    elif args.jobs > 1:
+        from batch import run_batch
+        from editor import find_input_videos
+        jobs = find_input_videos(args.preview)
+        if not jobs:
+            print(f"No video files found in {INPUT_DIR}/")
+            return
+        results = run_batch(jobs, args.jobs, args.preview)
+        if not all(status["ok"] for status in results):
+            raise SystemExit(1)
     else:
-        process_all_videos()
+        from editor import process_all_videos
+        process_all_videos(make_editor(args), args.preview)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
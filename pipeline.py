@@ -0,0 +1,337 @@
+import queue
+import threading
+from config import PIPELINE_QUEUE_SIZE, DETECTION_WORKERS, DETECTION_BATCH_SIZE
+from profiler import NULL_PROFILER
+
+_END = object()
+
+class RenderPipeline:
+    def __init__(self, detector, effects, text_overlay, detection_interval=3,
+                 queue_size=PIPELINE_QUEUE_SIZE, detection_workers=DETECTION_WORKERS,
+                 detection_batch_size=DETECTION_BATCH_SIZE, tracker=None, cache=None, profiler=NULL_PROFILER,
+                 frame_step=1, box_scale=1.0, speed_ramp=None, renditions=()):
+        self.detector = detector
+        self.effects = effects
+        self.text_overlay = text_overlay
+        self.detection_interval = detection_interval
+        self.queue_size = max(1, queue_size)
+        # The tracker decides which frames need detection from what it has
+        # seen so far, so scheduling has to happen on a single thread.
+        self.tracker = tracker
+        self.detection_workers = 1 if tracker is not None else max(1, detection_workers)
+        self.detection_batch_size = max(1, detection_batch_size)
+        self.cache = cache
+        self.profiler = profiler
+        # Proxy renders see every frame_step-th source frame at box_scale of
+        # the source size. Frame indices stay in source frames, the
+        # detection interval counts rendered frames, and cached boxes (which
+        # are in source pixels) are scaled on the way out.
+        self.frame_step = max(1, int(frame_step))
+        self.box_scale = box_scale
+        # Speed changes are applied after detection, so the detection
+        # schedule (and the cache) is the same with or without them. Dropped
+        # frames skip effects and are written zero times; repeated ones are
+        # rendered once and written several times.
+        self.speed_ramp = speed_ramp if speed_ramp is not None and not speed_ramp.constant else None
+        # Extra renditions (see renditions.py) see each frame between the
+        # effects and the main overlay.
+        self.renditions = list(renditions)
+        self.frames_done = 0
+        self._stop = threading.Event()
+        self._errors = []
+        self._in_flight = None
+        self._queues = {}
+
+    def run(self, cap, writer, total_frames, start_frame=0, end_frame=None):
+        self.frames_done = 0
+        self._stop.clear()
+        self._errors = []
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight())
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        detected = queue.Queue(maxsize=self.queue_size)
+        rendered = queue.Queue(maxsize=self.queue_size)
+        self._queues = {"decoded": decoded, "detected": detected, "rendered": rendered}
+
+        threads = [threading.Thread(target=self._guard, args=(self._decode_stage, cap, decoded, start_frame, end_frame), name="decode")]
+        detect_stage = self._tracking_detect_stage if self.tracker is not None else self._detect_stage
+        for i in range(self.detection_workers):
+            threads.append(threading.Thread(target=self._guard, args=(detect_stage, decoded, detected), name=f"detect-{i}"))
+        threads.append(threading.Thread(target=self._guard, args=(self._render_stage, detected, rendered, total_frames, start_frame), name="render"))
+        threads.append(threading.Thread(target=self._guard, args=(self._encode_stage, rendered, writer), name="encode"))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return self.frames_done
+
+    def max_in_flight(self):
+        # Every frame holds a slot from decode until it is encoded, so memory
+        # stays capped even when detection workers finish out of order. The
+        # cap is what the stages can hold at once: the three queues, one
+        # frame in hand at decode, render and encode, and one batch window
+        # per detection worker (the frames up to its last due frame wait with
+        # the batch so they leave in order). Slots are released in frame
+        # order, so the decoder's ring needs exactly this many buffers.
+        batch_window = self.detection_batch_size * self.detection_interval
+        return self.queue_size * 3 + 3 + self.detection_workers * batch_window
+
+    def rendered_in_flight(self):
+        # Frames between the render and encode stages: a full queue, one
+        # being written and one being rendered.
+        return self.queue_size + 2
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _acquire_slot(self):
+        while not self._stop.is_set():
+            if self._in_flight.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _decode_stage(self, cap, decoded, start_frame=0, end_frame=None):
+        frame_idx = start_frame
+        try:
+            while self._acquire_slot():
+                if end_frame is not None and frame_idx >= end_frame:
+                    self._in_flight.release()
+                    break
+                started = self.profiler.start()
+                ret, frame = cap.read()
+                self.profiler.stop("decode", started)
+                if not ret:
+                    self._in_flight.release()
+                    break
+                if not self._put(decoded, (frame_idx, frame)):
+                    break
+                frame_idx += self.frame_step
+        finally:
+            for _ in range(self.detection_workers):
+                self._put(decoded, _END)
+
+    def _detect_stage(self, decoded, detected):
+        batch_window = self.detection_batch_size * self.detection_interval
+        held = []
+        try:
+            while True:
+                item = self._get(decoded)
+                if item is _END:
+                    break
+                held.append(item)
+                due = sum(1 for frame_idx, _ in held if self._is_due(frame_idx))
+                if due >= self.detection_batch_size or len(held) >= batch_window:
+                    if not self._flush_batch(held, detected):
+                        return
+                    held = []
+            if not self._stop.is_set():
+                self._flush_batch(held, detected)
+        finally:
+            self._put(detected, _END)
+
+    def _flush_batch(self, held, detected):
+        due = [i for i, (frame_idx, _) in enumerate(held) if self._is_due(frame_idx)]
+        results = self._detect([held[i][0] for i in due], [held[i][1] for i in due])
+        detections = dict(zip(due, results))
+        for i, (frame_idx, frame) in enumerate(held):
+            if not self._put(detected, (frame_idx, frame, detections.get(i))):
+                return False
+        return True
+
+    def _is_due(self, frame_idx):
+        return (frame_idx // self.frame_step) % self.detection_interval == 0
+
+    def _detect(self, frame_indices, frames):
+        if not frames:
+            return []
+        if self.cache is None:
+            return self._run_detector(frames)
+
+        results = [self.cache.get(frame_idx) for frame_idx in frame_indices]
+        if self.box_scale != 1.0:
+            results = [None if detections is None else self._scale_boxes(detections) for detections in results]
+        missing = [i for i, detections in enumerate(results) if detections is None]
+        self.profiler.count("detection_cache_hits", len(frames) - len(missing))
+        if missing:
+            fresh = self._run_detector([frames[i] for i in missing])
+            # Without a model the detector returns empty placeholders, which
+            # must not be remembered as real results, and proxy boxes are
+            # neither at source scale nor from source pixels.
+            cacheable = self.detector.model is not None and self.box_scale == 1.0
+            for i, detections in zip(missing, fresh):
+                results[i] = detections
+                if cacheable:
+                    self.cache.put(frame_indices[i], detections)
+        return results
+
+    def _scale_boxes(self, detections):
+        detections = detections.copy()
+        detections[:, :4] *= self.box_scale
+        return detections
+
+    def _run_detector(self, frames):
+        started = self.profiler.start()
+        results = self.detector.detect_batch(frames)
+        self.profiler.stop("detect", started)
+        self.profiler.count("detection_calls")
+        self.profiler.count("detection_frames", len(frames))
+        return results
+
+    def _tracking_detect_stage(self, decoded, detected):
+        batch_window = self.detection_batch_size * self.detection_interval
+        held = []
+        since_due = None
+        planned = None
+        try:
+            while True:
+                item = self._get(decoded)
+                if item is _END:
+                    break
+                frame_idx, frame = item
+                started = self.profiler.start()
+                change = self.tracker.scene_change(frame)
+                self.profiler.stop("scene_change", started)
+                # A first guess from the interval as of the last flush, used
+                # to fill detection batches; _flush_tracked settles which
+                # frames are detected once earlier results are in.
+                due = planned is None or planned + 1 >= self.tracker.scheduled_interval(change)
+                planned = 0 if due else planned + 1
+                held.append((frame_idx, frame, due, change))
+
+                if sum(1 for entry in held if entry[2]) >= self.detection_batch_size or len(held) >= batch_window:
+                    ok, since_due = self._flush_tracked(held, since_due, detected)
+                    if not ok:
+                        return
+                    held = []
+                    planned = since_due
+            if not self._stop.is_set():
+                self._flush_tracked(held, since_due, detected)
+        finally:
+            self._put(detected, _END)
+
+    def _flush_tracked(self, held, since_due, detected):
+        results = {}
+        self._detect_into(results, [(entry[0], entry[1]) for entry in held if entry[2]])
+        for pos, (frame_idx, frame, _, change) in enumerate(held):
+            if change == "cut":
+                self.tracker.reset()
+            due = since_due is None or since_due + 1 >= self.tracker.scheduled_interval(change)
+            if due and frame_idx not in results:
+                # A detection earlier in the batch shortened the interval
+                # (a track was lost or new people appeared), so the rest of
+                # the batch is planned again at the new interval and
+                # detected together instead of predicted through.
+                self._detect_into(results, self._replan(held[pos:], since_due))
+            if frame_idx in results:
+                detections = self.tracker.update(results.pop(frame_idx))
+                since_due = 0
+            else:
+                detections = self.tracker.predict()
+                since_due += 1
+            if not self._put(detected, (frame_idx, frame, detections)):
+                return False, since_due
+        return True, since_due
+
+    def _replan(self, held, since_due):
+        due = []
+        for frame_idx, frame, _, change in held:
+            if since_due is None or since_due + 1 >= self.tracker.scheduled_interval(change):
+                due.append((frame_idx, frame))
+                since_due = 0
+            else:
+                since_due += 1
+        return due
+
+    def _detect_into(self, results, entries):
+        entries = [entry for entry in entries if entry[0] not in results]
+        frame_indices = [entry[0] for entry in entries]
+        results.update(zip(frame_indices, self._detect(frame_indices, [entry[1] for entry in entries])))
+
+    def _render_stage(self, detected, rendered, total_frames, start_frame=0):
+        pending = {}
+        next_idx = start_frame
+        finished_workers = 0
+        last_detections = []
+        try:
+            while finished_workers < self.detection_workers:
+                item = self._get(detected)
+                if item is _END:
+                    if self._stop.is_set():
+                        return
+                    finished_workers += 1
+                    continue
+                pending[item[0]] = item
+
+                # Detections carry forward to the frames between detection
+                # runs and the encoder needs frames in order, so render
+                # strictly in frame order.
+                while next_idx in pending:
+                    frame_idx, frame, detections = pending.pop(next_idx)
+                    if detections is not None:
+                        last_detections = detections
+                    if self.profiler.enabled:
+                        for name, q in self._queues.items():
+                            self.profiler.gauge(f"queue.{name}", q.qsize())
+                        self.profiler.gauge("pending_reorder", len(pending))
+                    repeats = self.speed_ramp.repeats(frame_idx, self.frame_step) if self.speed_ramp is not None else 1
+                    extras = [None] * len(self.renditions)
+                    if repeats:
+                        started = self.profiler.start()
+                        frame = self.effects.process_frame(frame, last_detections, frame_idx, total_frames)
+                        self.profiler.stop("effects", started)
+                        for i, rendition in enumerate(self.renditions):
+                            started = self.profiler.start()
+                            extras[i] = rendition.render(frame, last_detections, frame_idx, total_frames)
+                            self.profiler.stop(f"rendition.{rendition.name}", started)
+                        started = self.profiler.start()
+                        frame = self.text_overlay.process_frame(frame, last_detections, frame_idx, total_frames)
+                        self.profiler.stop("overlay", started)
+                    if not self._put(rendered, (frame, repeats, extras)):
+                        return
+                    next_idx += self.frame_step
+
+                    if next_idx % 100 < self.frame_step:
+                        print(f"Processed {next_idx}/{total_frames} frames ({100*next_idx/max(total_frames, 1):.1f}%)")
+        finally:
+            self._put(rendered, _END)
+
+    def _encode_stage(self, rendered, writer):
+        while True:
+            item = self._get(rendered)
+            if item is _END:
+                break
+            frame, repeats, extras = item
+            started = self.profiler.start()
+            for _ in range(repeats):
+                writer.write(frame)
+            for rendition, extra in zip(self.renditions, extras):
+                rendition.write(extra, repeats)
+            self.profiler.stop("encode", started)
+            self._in_flight.release()
+            self.frames_done += 1
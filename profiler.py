@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class NullProfiler:
+    # Stands in when profiling is off: the hot path still calls start/stop,
+    # but they do nothing beyond the method call.
+    enabled = False
+
+    def start(self):
+        return None
+
+    def stop(self, name, started):
+        return None
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+NULL_PROFILER = NullProfiler()
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+# Stage timings keep running totals and a fixed histogram (ten buckets per
+# decade from 1 us to 1000 s) instead of every sample, so a profile costs the
+# same memory however long the render. Percentiles are read from the
+# buckets, to within about 12%.
+_BUCKET_FLOOR = 1e-6
+_BUCKETS_PER_DECADE = 10
+_BUCKET_COUNT = 9 * _BUCKETS_PER_DECADE + 1
+
+class TimingStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * _BUCKET_COUNT
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        index = int(math.log10(max(seconds, _BUCKET_FLOOR) / _BUCKET_FLOOR) * _BUCKETS_PER_DECADE)
+        self.buckets[min(index, _BUCKET_COUNT - 1)] += 1
+
+    def percentile(self, q):
+        # The geometric middle of the bucket holding the q-th percentile,
+        # kept within the observed range.
+        rank = q / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                value = _BUCKET_FLOOR * 10 ** ((index + 0.5) / _BUCKETS_PER_DECADE)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+class Profiler:
+    enabled = True
+
+    def __init__(self, label=""):
+        self.label = label
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        return time.perf_counter()
+
+    def stop(self, name, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self.timings.get(name)
+            if stats is None:
+                stats = self.timings[name] = TimingStats()
+            stats.add(elapsed)
+        return elapsed
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self._lock:
+            stat = self.gauges.setdefault(name, [0, 0.0, value])
+            stat[0] += 1
+            stat[1] += value
+            stat[2] = max(stat[2], value)
+
+    def report(self, frames):
+        wall = time.perf_counter() - self.started
+        with self._lock:
+            stages = {}
+            for name, stats in sorted(self.timings.items()):
+                stages[name] = {
+                    "calls": stats.count,
+                    "total_seconds": stats.total,
+                    "per_frame_ms": stats.total * 1000 / frames if frames else None,
+                    "mean_ms": stats.total * 1000 / stats.count,
+                    "min_ms": stats.min * 1000,
+                    "p50_ms": stats.percentile(50) * 1000,
+                    "p95_ms": stats.percentile(95) * 1000,
+                    "max_ms": stats.max * 1000,
+                }
+            gauges = {name: {"mean": total / n, "max": peak} for name, (n, total, peak) in sorted(self.gauges.items())}
+            counters = dict(sorted(self.counters.items()))
+        return {
+            "video": self.label,
+            "frames": frames,
+            "wall_seconds": wall,
+            "fps": frames / wall if wall > 0 else None,
+            "stages": stages,
+            "counters": counters,
+            "gauges": gauges,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def write_json(self, path, report):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    def write_prometheus(self, path, report):
+        video = report["video"].replace("\\", "\\\\").replace('"', '\\"')
+        lines = []
+
+        # Every value describes one finished render and is replaced by the
+        # next one, so nothing here is a Prometheus counter: totals are
+        # gauges and stage timings a summary.
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP autoytedit_{name} {help_text}")
+            lines.append(f"# TYPE autoytedit_{name} {kind}")
+            for labels, value, *suffix in samples:
+                label_text = ",".join([f'video="{video}"'] + [f'{k}="{v}"' for k, v in labels.items()])
+                lines.append(f"autoytedit_{name}{''.join(suffix)}{{{label_text}}} {value}")
+
+        metric("frames", "gauge", "Frames rendered.", [({}, report["frames"])])
+        metric("render_seconds", "gauge", "Wall time of the render.", [({}, report["wall_seconds"])])
+        metric("fps", "gauge", "Average frames per second of the render.", [({}, report["fps"] or 0)])
+        stage_samples = []
+        for name, stats in report["stages"].items():
+            for quantile in ("0.5", "0.95"):
+                key = f"p{round(float(quantile) * 100)}_ms"
+                stage_samples.append(({"stage": name, "quantile": quantile}, stats[key] / 1000))
+            stage_samples.append(({"stage": name}, stats["total_seconds"], "_sum"))
+            stage_samples.append(({"stage": name}, stats["calls"], "_count"))
+        metric("stage_seconds", "summary", "Time per call of each pipeline stage.", stage_samples)
+        metric("stage_seconds_max", "gauge", "Slowest call of each pipeline stage.",
+               [({"stage": name}, stats["max_ms"] / 1000) for name, stats in report["stages"].items()])
+        metric("events", "gauge", "Event counts such as detection calls and cache hits.",
+               [({"event": name}, value) for name, value in report["counters"].items()])
+        metric("gauge_max", "gauge", "High-water mark of sampled gauges such as queue depths.",
+               [({"gauge": name}, stats["max"]) for name, stats in report["gauges"].items()])
+        if report["peak_rss_bytes"]:
+            metric("peak_rss_bytes", "gauge", "Peak resident set size.",
+                   [({"process": name}, value) for name, value in report["peak_rss_bytes"].items()])
+
+        # Written then renamed, so a scraper never reads a half-written file.
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
@@ -0,0 +1,188 @@
+import os
+import shutil
+import cv2
+import numpy as np
+from config import VERTICAL_SIZE, VERTICAL_FOLLOW, VERTICAL_PRESET, VERTICAL_CRF, THUMBNAIL_WIDTH
+from encoder import FFmpegPipeWriter, concat_segments
+from text_overlay import TextOverlay
+
+RENDITION_NAMES = ("vertical", "thumbnail")
+
+def rendition_path(path, name):
+    # Extra renditions sit next to the main output: video_edited.mp4 gives
+    # video_edited_vertical.mp4 and video_edited_thumb.jpg.
+    root, ext = os.path.splitext(path)
+    if name == "thumbnail":
+        return f"{root}_thumb.jpg"
+    return f"{root}_{name}{ext}"
+
+# Renditions are extra outputs of one render pass. The pipeline hands each
+# of them the frame after effects and before the main overlay is drawn on
+# it, so decode, detection and effects run once however many are written.
+# render() runs on the render thread and returns what write() later gets on
+# the encode thread, along with how many times the speed ramp shows it.
+# state() is whatever a rendition carries between frames; a render that
+# starts mid-video either restore()s it from the chunk before or rebuilds
+# it by passing the preceding frames' detections to warm_up().
+class VerticalRendition:
+    # A 9:16 window of the source that follows the main person, scaled to
+    # VERTICAL_SIZE, with captions centred for the narrow frame.
+    name = "vertical"
+
+    def __init__(self, path, source_width, source_height, fps, plan, detector, ring_size,
+                 audio_source=None, audio_tempo=None, size=VERTICAL_SIZE):
+        self.path = path
+        self.detector = detector
+        self.width, self.height = size
+        self.source_width = source_width
+        self.crop_width = min(source_width, int(round(source_height * self.width / self.height)))
+        self.crop_height = min(source_height, int(round(self.crop_width * self.height / self.width)))
+        self.top = (source_height - self.crop_height) // 2
+        self.scale = self.height / self.crop_height
+        self.overlay = TextOverlay(plan)
+        self.overlay.layout = "centered"
+        self.overlay.scale = self.scale
+        self.center = None
+        # Each frame stays queued for the encoder after render() returns,
+        # so the ring must outlast every frame between the two stages.
+        self.ring = [np.empty((self.height, self.width, 3), dtype=np.uint8) for _ in range(ring_size)]
+        self.next_slot = 0
+        self.writer = FFmpegPipeWriter(path, self.width, self.height, fps, audio_source=audio_source,
+                                       audio_tempo=audio_tempo, preset=VERTICAL_PRESET, crf=VERTICAL_CRF)
+
+    def window(self, detections):
+        # The centre eases towards the main person instead of snapping to
+        # every detection, and holds still while nobody is detected.
+        main = self.detector.track_main_person(detections)
+        if main is not None:
+            target = (main[0] + main[2]) / 2
+            self.center = target if self.center is None else self.center + (target - self.center) * VERTICAL_FOLLOW
+        elif self.center is None:
+            self.center = self.source_width / 2
+        left = int(round(self.center - self.crop_width / 2))
+        return min(max(left, 0), self.source_width - self.crop_width)
+
+    def warm_up(self, detections):
+        self.window(detections)
+
+    def state(self):
+        # The crop centre is all that carries from one frame to the next, so
+        # a chunk that restores it continues the pan where the last one
+        # stopped instead of snapping back to the middle.
+        return {"center": None if self.center is None else float(self.center)}
+
+    def restore(self, state):
+        self.center = state.get("center")
+
+    def crop_boxes(self, detections, left):
+        if detections is None or len(detections) == 0:
+            return detections
+        boxes = np.array(detections, dtype=np.float32)
+        boxes[:, [0, 2]] -= left
+        boxes[:, [1, 3]] -= self.top
+        boxes[:, :4] *= self.scale
+        return boxes[(boxes[:, 2] > 0) & (boxes[:, 0] < self.width)]
+
+    def render(self, frame, detections, frame_idx, total_frames):
+        left = self.window(detections)
+        out = self.ring[self.next_slot]
+        self.next_slot = (self.next_slot + 1) % len(self.ring)
+        crop = frame[self.top:self.top + self.crop_height, left:left + self.crop_width]
+        cv2.resize(crop, (self.width, self.height), dst=out, interpolation=cv2.INTER_LINEAR)
+        return self.overlay.process_frame(out, self.crop_boxes(detections, left), frame_idx, total_frames)
+
+    def write(self, frame, repeats):
+        for _ in range(repeats):
+            self.writer.write(frame)
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        self.writer.abort()
+
+class ThumbnailRendition:
+    # Keeps a copy of the graded frame (before any overlay) with the most
+    # confident person detection: a frame scores the highest confidence
+    # among its boxes, whoever they belong to, and the first frame with the
+    # best score wins. Until someone is detected the first frame stands in.
+    name = "thumbnail"
+
+    def __init__(self, path, width=THUMBNAIL_WIDTH):
+        self.path = path
+        self.width = width
+        self.score = None
+        self.frame_idx = None
+        self.frame = None
+
+    def render(self, frame, detections, frame_idx, total_frames):
+        score = 0.0
+        if detections is not None and len(detections) > 0:
+            score = float(np.asarray(detections)[:, 4].max())
+        if self.score is None or score > self.score:
+            if self.frame is None or self.frame.shape != frame.shape:
+                self.frame = np.empty_like(frame)
+            np.copyto(self.frame, frame)
+            self.score, self.frame_idx = score, frame_idx
+        return None
+
+    def write(self, frame, repeats):
+        pass
+
+    def warm_up(self, detections):
+        pass
+
+    def state(self):
+        return None
+
+    def restore(self, state):
+        pass
+
+    def close(self):
+        if self.frame is None:
+            raise RuntimeError("No frames rendered for the thumbnail")
+        h, w = self.frame.shape[:2]
+        image = self.frame
+        if w > self.width:
+            image = cv2.resize(image, (self.width, int(round(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        if not cv2.imwrite(self.path, image):
+            raise OSError(f"Could not write thumbnail: {self.path}")
+
+    def abort(self):
+        pass
+
+def open_renditions(paths, source_width, source_height, fps, plan, detector, ring_size,
+                    audio_source=None, audio_tempo=None):
+    # paths maps each rendition name to the file it is written to.
+    renditions = []
+    try:
+        for name, path in paths.items():
+            if name == "vertical":
+                renditions.append(VerticalRendition(path, source_width, source_height, fps, plan, detector, ring_size,
+                                                    audio_source=audio_source, audio_tempo=audio_tempo))
+            elif name == "thumbnail":
+                renditions.append(ThumbnailRendition(path))
+            else:
+                raise ValueError(f"Unknown rendition: {name}")
+    except Exception:
+        for rendition in renditions:
+            rendition.abort()
+        raise
+    return renditions
+
+def join_renditions(names, segment_paths, output_path, work_dir, audio_source=None, audio_tempo=None,
+                    thumbnail_scores=()):
+    # Video renditions of separately rendered segments are joined like the
+    # main output, and the thumbnail is the best of the segments' picks.
+    for name in names:
+        final_path = rendition_path(output_path, name)
+        if name == "thumbnail":
+            scored = [(score, rendition_path(path, name)) for score, path in zip(thumbnail_scores, segment_paths)
+                      if score is not None]
+            if scored:
+                shutil.copyfile(max(scored, key=lambda entry: entry[0])[1], final_path)
+            continue
+        joined = os.path.join(work_dir, f"joined_{name}{os.path.splitext(output_path)[1]}")
+        concat_segments([rendition_path(path, name) for path in segment_paths], joined,
+                        os.path.join(work_dir, f"{name}.txt"), audio_source=audio_source, audio_tempo=audio_tempo)
+        shutil.move(joined, final_path)
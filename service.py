@@ -0,0 +1,417 @@
+import ctypes
+import ctypes.util
+import json
+import multiprocessing
+import os
+import select
+import signal
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from config import (
+    INPUT_DIR, SERVICE_DB, SERVICE_WORKERS, SERVICE_POLL_SECONDS, SERVICE_STATUS_HOST, SERVICE_STATUS_PORT,
+    SERVICE_MAX_ATTEMPTS, ensure_directories
+)
+from detection_cache import file_digest
+
+# Largest page /jobs returns.
+_MAX_JOBS_LIMIT = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    variant TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_digest ON jobs (digest);
+CREATE INDEX IF NOT EXISTS jobs_input ON jobs (input_path);
+"""
+
+# A job moves queued -> running -> done or failed, and goes back to queued
+# if it fails with attempts left or the service dies while it runs.
+# Duplicates of content that is already queued, running or done in the same
+# variant (full render or preview) are recorded as skipped.
+class JobQueue:
+    def __init__(self, path=SERVICE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        db = self._connect()
+        try:
+            db.executescript(_SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # One short-lived connection per call, so the status server thread
+        # and the scheduler never share one.
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _query(self, sql, args=()):
+        db = self._connect()
+        try:
+            with db:
+                return [dict(row) for row in db.execute(sql, args)]
+        finally:
+            db.close()
+
+    def _execute(self, sql, args=()):
+        db = self._connect()
+        try:
+            with db:
+                return db.execute(sql, args).lastrowid
+        finally:
+            db.close()
+
+    def recover(self):
+        db = self._connect()
+        try:
+            with db:
+                return db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'").rowcount
+        finally:
+            db.close()
+
+    def known(self, input_path, size, mtime, variant=""):
+        # A file already seen with the same size and mtime is not hashed again.
+        rows = self._query("SELECT id FROM jobs WHERE input_path = ? AND size = ? AND mtime = ? AND variant = ? LIMIT 1",
+                           (input_path, size, mtime, variant))
+        return bool(rows)
+
+    def enqueue(self, input_path, output_path, variant=""):
+        stat = os.stat(input_path)
+        if self.known(input_path, stat.st_size, stat.st_mtime, variant):
+            return None
+        digest = file_digest(input_path)
+        now = time.time()
+        previous = self._query(
+            "SELECT id, output_path, status FROM jobs WHERE digest = ? AND variant = ? "
+            "AND status IN ('queued', 'running', 'done') ORDER BY id DESC LIMIT 1", (digest, variant))
+        if previous and (previous[0]["status"] != "done" or os.path.exists(previous[0]["output_path"])):
+            self._execute(
+                "INSERT INTO jobs (input_path, output_path, digest, variant, size, mtime, status, error, created, finished) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'skipped', ?, ?, ?)",
+                (input_path, previous[0]["output_path"], digest, variant, stat.st_size, stat.st_mtime,
+                 f"same content as job {previous[0]['id']}", now, now))
+            return None
+        return self._execute(
+            "INSERT INTO jobs (input_path, output_path, digest, variant, size, mtime, status, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (input_path, output_path, digest, variant, stat.st_size, stat.st_mtime, now))
+
+    def claim(self):
+        db = self._connect()
+        try:
+            with db:
+                row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1 WHERE id = ?",
+                           (time.time(), row["id"]))
+                return dict(row)
+        finally:
+            db.close()
+
+    def release(self, job_id):
+        # Puts back a job that was cut short by shutdown, without counting
+        # the attempt.
+        self._execute("UPDATE jobs SET status = 'queued', started = NULL, attempts = MAX(attempts - 1, 0) "
+                      "WHERE id = ?", (job_id,))
+
+    def finish(self, job_id, ok, error=None, seconds=None, max_attempts=SERVICE_MAX_ATTEMPTS):
+        if ok:
+            status = "done"
+        else:
+            attempts = self._query("SELECT attempts FROM jobs WHERE id = ?", (job_id,))[0]["attempts"]
+            status = "queued" if attempts < max_attempts else "failed"
+        self._execute("UPDATE jobs SET status = ?, error = ?, finished = ?, seconds = ? WHERE id = ?",
+                      (status, error, time.time(), seconds, job_id))
+        return status
+
+    def counts(self):
+        return {row["status"]: row["n"] for row in self._query("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+
+    def jobs(self, status=None, limit=20):
+        columns = "id, input_path, output_path, variant, status, attempts, error, created, started, finished, seconds"
+        if status:
+            return self._query(f"SELECT {columns} FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+        return self._query(f"SELECT {columns} FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+
+class InotifyWatcher:
+    # Linux inotify through libc, so no extra dependency is needed. Files
+    # are reported once they are closed after writing or moved in whole.
+    name = "inotify"
+    IN_CLOSE_WRITE = 0x08
+    IN_MOVED_TO = 0x80
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        self.directory = directory
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def changes(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        paths = []
+        offset = 0
+        while offset + self._EVENT.size <= len(data):
+            _, _, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    # Reports a file once its size and mtime have held still for one poll,
+    # so files still being copied in are not picked up half-written.
+    name = "polling"
+
+    def __init__(self, directory, interval=SERVICE_POLL_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self._pending = {}
+        self._reported = {}
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        paths = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return paths
+        current = {}
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            current[path] = (stat.st_size, stat.st_mtime)
+            if self._pending.get(path) == current[path] and self._reported.get(path) != current[path]:
+                self._reported[path] = current[path]
+                paths.append(path)
+        self._pending = current
+        return paths
+
+    def close(self):
+        pass
+
+def make_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        print(f"inotify unavailable ({e}), polling {directory}/ every {SERVICE_POLL_SECONDS}s")
+        return PollingWatcher(directory)
+
+class RenderService:
+    def __init__(self, workers=SERVICE_WORKERS, queue=None, input_dir=INPUT_DIR,
+                 host=SERVICE_STATUS_HOST, port=SERVICE_STATUS_PORT, preview=False):
+        self.workers = max(1, workers)
+        self.queue = queue or JobQueue()
+        self.input_dir = input_dir
+        self.host = host
+        self.port = port
+        self.preview = preview
+        self.started = time.time()
+        self.watcher = None
+        # _running is changed by the scheduler loop and read by status
+        # requests on the HTTP server's threads.
+        self._running = {}
+        self._running_lock = threading.Lock()
+        # New files are hashed off the scheduler loop, one at a time, so a
+        # large upload never holds up dispatch and two copies of one file
+        # cannot both pass the duplicate check.
+        self._hasher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash")
+        self._stop = threading.Event()
+
+    def status(self):
+        with self._running_lock:
+            running = list(self._running.values())
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": time.time() - self.started,
+            "workers": self.workers,
+            "watcher": self.watcher.name if self.watcher else None,
+            "counts": self.queue.counts(),
+            "running": [dict(job, running_seconds=time.time() - job["started"]) for job in running],
+            "recent": self.queue.jobs(limit=20),
+        }
+
+    def offer(self, path):
+        from editor import VIDEO_EXTENSIONS, output_path_for
+        if not path.lower().endswith(VIDEO_EXTENSIONS) or not os.path.isfile(path):
+            return
+        self._hasher.submit(self._enqueue, path, output_path_for(path, self.preview))
+
+    def _enqueue(self, path, output_path):
+        try:
+            job_id = self.queue.enqueue(path, output_path, "preview" if self.preview else "")
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not queue {path}: {e}")
+            return
+        if job_id is not None:
+            print(f"Queued job {job_id}: {path}")
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run(self):
+        from batch import _init_worker, _render
+        ensure_directories()
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"Requeued {recovered} job(s) interrupted by the last shutdown")
+        self.watcher = make_watcher(self.input_dir)
+        for name in sorted(os.listdir(self.input_dir)):
+            self.offer(os.path.join(self.input_dir, name))
+        server = self._start_status_server()
+        signal.signal(signal.SIGTERM, self.stop)
+
+        # Worker processes load the editor and model once and keep them for
+        # every job they run.
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                   initializer=_init_worker, initargs=(self.workers,))
+        print(f"Watching {self.input_dir}/ with {self.workers} worker(s) ({self.watcher.name})")
+        try:
+            while not self._stop.is_set():
+                for path in self.watcher.changes(0.5):
+                    self.offer(path)
+                while len(self._running) < self.workers and not self._stop.is_set():
+                    job = self.queue.claim()
+                    if job is None:
+                        break
+                    job["started"] = time.time()
+                    print(f"Starting job {job['id']}: {job['input_path']}")
+                    future = pool.submit(_render, job["input_path"], job["output_path"], self.preview)
+                    with self._running_lock:
+                        self._running[future] = job
+                pool = self._collect(pool, _init_worker)
+        except KeyboardInterrupt:
+            self._stop.set()
+        finally:
+            self._stop.set()
+            self._hasher.shutdown(wait=False, cancel_futures=True)
+            print(f"Stopping; waiting for {len(self._running)} running job(s)")
+            pool.shutdown(wait=True, cancel_futures=True)
+            self._collect(None, None)
+            self.watcher.close()
+            if server is not None:
+                server.shutdown()
+
+    def _collect(self, pool, initializer):
+        broken = False
+        with self._running_lock:
+            finished = [(future, self._running.pop(future)) for future in list(self._running) if future.done()]
+        for future, job in finished:
+            try:
+                result = future.result()
+                ok, error, seconds = result["ok"], result["error"], result["seconds"]
+            except BrokenProcessPool as e:
+                broken = True
+                ok, error, seconds = False, f"worker crashed: {e}", time.time() - job["started"]
+            except Exception as e:
+                ok, error, seconds = False, str(e), time.time() - job["started"]
+            if not ok and self._stop.is_set():
+                self.queue.release(job["id"])
+                print(f"Job {job['id']} interrupted, requeued: {job['input_path']}")
+                continue
+            status = self.queue.finish(job["id"], ok, error, seconds)
+            print(f"Job {job['id']} {status} after {seconds:.1f}s: {job['input_path']}")
+        if broken and pool is not None and not self._stop.is_set():
+            # A crashed worker breaks the whole pool; replace it so the
+            # service keeps going.
+            pool.shutdown(wait=False, cancel_futures=True)
+            context = multiprocessing.get_context("spawn")
+            pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                       initializer=initializer, initargs=(self.workers,))
+        return pool
+
+    def _start_status_server(self):
+        if not self.port:
+            return None
+        service = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path in ("/", "/status"):
+                    body = service.status()
+                elif url.path == "/jobs":
+                    params = parse_qs(url.query)
+                    status = params.get("status", [None])[0]
+                    try:
+                        limit = int(params.get("limit", ["100"])[0])
+                    except ValueError:
+                        limit = 0
+                    if not 1 <= limit <= _MAX_JOBS_LIMIT:
+                        self.send_error(400, f"limit must be an integer from 1 to {_MAX_JOBS_LIMIT}")
+                        return
+                    body = service.queue.jobs(status, limit)
+                else:
+                    self.send_error(404)
+                    return
+                data = json.dumps(body, indent=2).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((self.host, self.port), StatusHandler)
+        except OSError as e:
+            print(f"Status server disabled: {e}")
+            return None
+        threading.Thread(target=server.serve_forever, name="status", daemon=True).start()
+        print(f"Status at http://{self.host}:{server.server_address[1]}/status")
+        return server
+
+def print_status(queue=None):
+    if queue is None and not os.path.exists(SERVICE_DB):
+        print(f"No job queue at {SERVICE_DB} yet; start one with --watch")
+        return
+    queue = queue or JobQueue()
+    counts = queue.counts()
+    print("Jobs: " + (", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "none"))
+    for job in queue.jobs(limit=20):
+        seconds = f"{job['seconds']:.1f}s" if job["seconds"] is not None else ""
+        print(f"  #{job['id']:<5} {job['status']:<8} {seconds:>8}  {job['input_path']}")
+        if job["status"] in ("failed", "skipped") and job["error"]:
+            print(f"         {job['error'].strip().splitlines()[-1]}")
@@ -0,0 +1,86 @@
+import math
+import numpy as np
+from config import SPEED_RAMP_FRAMES
+
+def _smoothstep(t):
+    return t * t * (3 - 2 * t)
+
+# Speed changes are a remapping of source frames onto the output timeline:
+# source frame i lasts 1/speed[i] output frames, and it is written once for
+# every output frame slot that starts inside that span. Fast sections drop
+# frames, slow ones repeat them, and nothing is re-encoded afterwards. The
+# timeline is a prefix sum over the whole plan, so a chunk or segment
+# rendered on its own writes exactly its share of the joined output.
+class SpeedRamp:
+    def __init__(self, speeds, ramps=()):
+        self.speeds = np.asarray(speeds, dtype=np.float64)
+        # Output position (in output frames at the source rate) at which
+        # each source frame starts; one extra entry for the end.
+        self.positions = np.concatenate([[0.0], np.cumsum(1.0 / self.speeds)])
+        self.ramps = list(ramps)
+        self.constant = bool(np.all(self.speeds == 1.0))
+
+    @classmethod
+    def from_plan(cls, plan, ramp_frames=SPEED_RAMP_FRAMES):
+        # Each change of speed is eased over ramp_frames frames centred on
+        # the cut, rather than jumping.
+        total = plan.total_frames
+        speeds = np.ones(total, dtype=np.float64)
+        for span in plan.speeds:
+            speeds[span["start"]:span["end"]] = span["speed"]
+        ramps = []
+        half = max(0, ramp_frames // 2)
+        for before, after in zip(plan.speeds, plan.speeds[1:]):
+            if before["speed"] == after["speed"]:
+                continue
+            start, end = max(0, after["start"] - half), min(total, after["start"] + half)
+            if end > start:
+                t = (np.arange(start, end) - (after["start"] - half) + 0.5) / (2 * half)
+                speeds[start:end] = before["speed"] + (after["speed"] - before["speed"]) * _smoothstep(t)
+            ramps.append((start, end))
+        return cls(speeds, ramps)
+
+    def speed_at(self, frame_idx):
+        if 0 <= frame_idx < len(self.speeds):
+            return float(self.speeds[frame_idx])
+        return 1.0
+
+    def _position(self, frame_idx):
+        # Frames past the end of the plan (frame counts from the container
+        # can be approximate) play at normal speed.
+        total = len(self.speeds)
+        if frame_idx <= total:
+            return float(self.positions[frame_idx])
+        return float(self.positions[total]) + frame_idx - total
+
+    def output_frames(self, frame_idx, step=1):
+        # Number of output frames written for the source frames before
+        # frame_idx. Proxy renders keep every step-th frame at 1/step of the
+        # rate, so their output slots are step source frames apart. The
+        # small epsilon keeps slots that land exactly on a frame boundary
+        # from flipping with rounding error.
+        return math.ceil(self._position(frame_idx) / step - 1e-9)
+
+    def repeats(self, frame_idx, step=1):
+        return self.output_frames(frame_idx + step, step) - self.output_frames(frame_idx, step)
+
+    def audio_tempo(self, fps):
+        # Piecewise-constant tempo for the source audio as (start_seconds,
+        # end_seconds, tempo) pieces, cut at the edges of every ramp. Each
+        # piece is stretched to exactly the output duration of its frames,
+        # so audio and video agree at every cut whatever happens inside a
+        # ramp. Without speed changes this is one piece at tempo 1, which
+        # still fixes the audio to the video's length.
+        total = len(self.speeds)
+        cuts = sorted({0, total} | {edge for ramp in self.ramps for edge in ramp})
+        fps = float(fps)
+        pieces = []
+        for start, end in zip(cuts, cuts[1:]):
+            if end <= start:
+                continue
+            tempo = (end - start) / (self._position(end) - self._position(start))
+            if pieces and abs(pieces[-1][2] - tempo) < 1e-9:
+                pieces[-1] = (pieces[-1][0], end / fps, tempo)
+            else:
+                pieces.append((start / fps, end / fps, tempo))
+        return pieces
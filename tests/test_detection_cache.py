@@ -0,0 +1,23 @@
+import detection_cache
+
+def _settings(monkeypatch, model):
+    monkeypatch.setattr(detection_cache, "DETECTION_BACKEND", "torch")
+    monkeypatch.setattr(detection_cache, "DETECTION_MODEL", model)
+    detection_cache._model_identity.cache_clear()
+    return detection_cache.detection_settings()
+
+def test_downloaded_weights_are_keyed_by_name_in_any_directory(tmp_path, monkeypatch):
+    keys = []
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        monkeypatch.chdir(tmp_path / name)
+        keys.append(_settings(monkeypatch, "yolov8n.pt"))
+    assert keys[0] == keys[1]
+    assert "model=yolov8n.pt;" in keys[0]
+
+def test_local_weights_are_keyed_by_content(tmp_path, monkeypatch):
+    weights = tmp_path / "custom.pt"
+    weights.write_bytes(b"first")
+    first = _settings(monkeypatch, str(weights))
+    weights.write_bytes(b"second")
+    assert _settings(monkeypatch, str(weights)) != first
@@ -0,0 +1,60 @@
+import numpy as np
+from detector_backends import LETTERBOX_COLOR, letterbox, nms, postprocess
+
+# Fixed inputs with hand-computed expected boxes, so the ONNX/OpenVINO
+# preprocessing and NMS can be checked without any exported model. The
+# real-weights comparison against torch is benchmarks/detector_parity.py.
+
+def test_letterbox_pads_centred_and_converts_to_rgb():
+    frame = np.empty((480, 640, 3), dtype=np.uint8)
+    frame[:] = (10, 20, 30)
+    blob, transforms = letterbox([frame], 640)
+    assert blob.shape == (1, 3, 640, 640)
+    assert transforms == [(1.0, 0, 80)]
+    np.testing.assert_allclose(blob[0, :, 300, 300], np.array([30, 20, 10]) / 255, rtol=1e-6)
+    np.testing.assert_allclose(blob[0, :, 40, 300], LETTERBOX_COLOR / 255, rtol=1e-6)
+    np.testing.assert_allclose(blob[0, :, 600, 300], LETTERBOX_COLOR / 255, rtol=1e-6)
+
+def test_letterbox_scales_wide_frames_down():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    _, transforms = letterbox([frame], 640)
+    scale, left, top = transforms[0]
+    assert abs(scale - 1 / 3) < 1e-9
+    assert (left, top) == (0, 140)
+
+def test_nms_keeps_best_of_each_overlapping_group():
+    boxes = np.array([
+        [20, 20, 30, 30],
+        [1, 1, 11, 11],
+        [0, 0, 10, 10],
+    ], dtype=np.float32)
+    scores = np.array([0.7, 0.8, 0.9], dtype=np.float32)
+    # The two boxes near the origin overlap with an IoU of 81/119.
+    assert list(nms(boxes, scores, 0.5)) == [2, 0]
+    assert list(nms(boxes, scores, 0.7)) == [2, 1, 0]
+
+def _prediction(anchors, classes=3):
+    prediction = np.zeros((4 + classes, len(anchors)), dtype=np.float32)
+    for i, (cx, cy, w, h, scores) in enumerate(anchors):
+        prediction[:4, i] = (cx, cy, w, h)
+        prediction[4:4 + len(scores), i] = scores
+    return prediction
+
+def test_postprocess_filters_suppresses_and_maps_back_to_the_frame():
+    prediction = _prediction([
+        (320, 320, 100, 200, (0.9,)),
+        (322, 318, 100, 200, (0.8,)),        # duplicate of the first
+        (100, 300, 50, 50, (0.6, 0.95)),     # another class scores higher
+        (500, 300, 50, 50, (0.3,)),          # below the confidence threshold
+        (10, 500, 40, 40, (0.7,)),           # runs off the left edge
+    ])
+    detections = postprocess(prediction, (0.5, 0, 80), (960, 1280), conf=0.5, iou=0.7)
+    np.testing.assert_allclose(detections, [
+        [540, 280, 740, 680, 0.9, 0],
+        [0, 800, 60, 880, 0.7, 0],
+    ], rtol=1e-6)
+
+def test_postprocess_without_people_is_empty():
+    prediction = _prediction([(320, 320, 100, 200, (0.2, 0.9))])
+    detections = postprocess(prediction, (1.0, 0, 0), (640, 640), conf=0.5, iou=0.7)
+    assert detections.shape == (0, 6)
@@ -1,156 +1,364 @@
 import cv2
 import numpy as np
 import random
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
-from config import get_random_caption, get_random_intro, get_random_color, COLORS, SHADOW_COLORS
+from config import (
+    COLORS, SHADOW_COLORS,
+    TEXT_SPRITE_CACHE_SIZE, TEXT_ANIMATION_STEPS, TEXT_OUTLINE_MAX_WIDTH,
+    TEXT_SPRITE_TINTS, LABEL_SPRITE_CACHE_SIZE
+)
+from edit_plan import EditPlan
+from frame_pool import FramePool
+from profiler import NULL_PROFILER
+
+@lru_cache(maxsize=None)
+def load_font(size):
+    try:
+        return ImageFont.truetype("arial.ttf", size)
+    except:
+        try:
+            return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size)
+        except:
+            return ImageFont.load_default()
+
+class TextSprite:
+    def __init__(self, rgba, dx, dy):
+        # Stored pre-multiplied so compositing is one multiply-add per pixel.
+        alpha = rgba[:, :, 3:4].astype(np.uint16)
+        self.color = cv2.cvtColor(rgba[:, :, :3], cv2.COLOR_RGB2BGR).astype(np.uint16) * alpha
+        self.inv_alpha = 255 - alpha
+        self.dx = dx
+        self.dy = dy
+        self.height, self.width = rgba.shape[:2]
+
+    def blend(self, frame, position):
+        h, w = frame.shape[:2]
+        x, y = position[0] + self.dx, position[1] + self.dy
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + self.width, w), min(y + self.height, h)
+        if x0 >= x1 or y0 >= y1:
+            return frame
+
+        roi = frame[y0:y1, x0:x1]
+        sy, sx = slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)
+        blended = roi * self.inv_alpha[sy, sx]
+        blended += self.color[sy, sx]
+        blended += 127
+        blended //= 255
+        roi[:] = blended
+        return frame
+
+@lru_cache(maxsize=TEXT_SPRITE_CACHE_SIZE)
+def render_text_sprite(text, font_size, color):
+    font = load_font(font_size)
+    left, top, right, bottom = font.getbbox(text)
+    img = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text((-left, -top), text, font=font, fill=color)
+    return TextSprite(np.array(img), left, top)
+
+class OutlinedTextSprite:
+    # Coverage of the fill and of the outline around it, without colour, so
+    # one sprite serves every colour a caption cycles through; the colours
+    # are mixed in while blending.
+    def __init__(self, fill, outline, dx, dy):
+        self.fill = fill[:, :, None].astype(np.uint16)
+        self.outline = outline[:, :, None].astype(np.uint16)
+        self.inv_alpha = 255 - self.fill - self.outline
+        # Pre-multiplied colour per (colour, outline colour); captions use a
+        # handful, so this stays small and blending stays one multiply-add.
+        self.tints = {}
+        self.dx = dx
+        self.dy = dy
+        self.height, self.width = fill.shape
+
+    def tint(self, color, outline_color):
+        key = (color, outline_color)
+        tint = self.tints.get(key)
+        if tint is None:
+            if len(self.tints) >= TEXT_SPRITE_TINTS:
+                self.tints.clear()
+            # Colours are RGB like the PIL sprites; frames are BGR.
+            tint = self.fill * np.array(color[::-1], dtype=np.uint16)
+            tint += self.outline * np.array(outline_color[::-1], dtype=np.uint16)
+            self.tints[key] = tint
+        return tint
+
+    def blend(self, frame, position, color, outline_color):
+        h, w = frame.shape[:2]
+        x, y = position[0] + self.dx, position[1] + self.dy
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + self.width, w), min(y + self.height, h)
+        if x0 >= x1 or y0 >= y1:
+            return frame
+
+        roi = frame[y0:y1, x0:x1]
+        sy, sx = slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)
+        blended = roi * self.inv_alpha[sy, sx]
+        blended += self.tint(color, outline_color)[sy, sx]
+        blended += 127
+        blended //= 255
+        roi[:] = blended
+        return frame
+
+@lru_cache(maxsize=TEXT_SPRITE_CACHE_SIZE)
+def render_outlined_text_sprite(text, font_size, outline_width):
+    # PIL strokes the outline in one pass; the fill is drawn over it, so
+    # the outline's share of a pixel is whatever the fill leaves uncovered.
+    font = load_font(font_size)
+    left, top, right, bottom = font.getbbox(text)
+    pad = outline_width
+    size = (right - left + 2 * pad, bottom - top + 2 * pad)
+    origin = (pad - left, pad - top)
+    fill = Image.new("L", size, 0)
+    ImageDraw.Draw(fill).text(origin, text, font=font, fill=255)
+    whole = Image.new("L", size, 0)
+    ImageDraw.Draw(whole).text(origin, text, font=font, fill=255, stroke_width=outline_width, stroke_fill=255)
+    fill = np.array(fill, dtype=np.int32)
+    whole = np.array(whole, dtype=np.int32)
+    outline = (255 - fill) * whole // 255
+    return OutlinedTextSprite(fill, outline, left - pad, top - pad)
+
+PERSON_LABELS = ["MAIN CHARACTER", "NPC", "LEGEND", "GOAT", "REAL ONE", "VIBE CHECK", "W", "ICONIC"]
+
+class LabelSprite:
+    # Label tags are opaque (a filled box with black text), so they are
+    # pasted rather than blended.
+    def __init__(self, image):
+        self.image = image
+        self.height, self.width = image.shape[:2]
+
+    def paste(self, frame, position):
+        h, w = frame.shape[:2]
+        x, y = position
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + self.width, w), min(y + self.height, h)
+        if x0 < x1 and y0 < y1:
+            frame[y0:y1, x0:x1] = self.image[y0 - y:y1 - y, x0 - x:x1 - x]
+        return frame
+
+@lru_cache(maxsize=LABEL_SPRITE_CACHE_SIZE)
+def render_label_sprite(label, color, font_scale, thickness, height, pad, baseline):
+    width = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)[0][0]
+    image = np.empty((height + 1, width + 2 * pad + 1, 3), dtype=np.uint8)
+    image[:] = color
+    cv2.putText(image, label, (pad, height - baseline), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), thickness)
+    return LabelSprite(image)
+
+# Tracking geometry is looked up from one row of coordinates per box, so
+# the vertices of every guide line, corner bracket and outline in a frame
+# come out of a single fancy index. Row layout:
+# x1, y1, x2, y2, cx, cy, 0, frame width, frame height, x1 + corner,
+# x2 - corner, y1 + corner, y2 - corner.
+_X1, _Y1, _X2, _Y2, _CX, _CY, _ZERO, _WIDTH, _HEIGHT, _X1C, _X2C, _Y1C, _Y2C = range(13)
+# The rows are one matrix product of the boxes, at twice the scale so that
+# halving afterwards floors the centres like (x1 + x2) // 2.
+_TABLE_WEIGHTS = np.array([
+    [2, 0, 0, 0, 1, 0, 0, 0, 0, 2, 0, 0, 0],
+    [0, 2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 2, 0],
+    [0, 0, 2, 0, 1, 0, 0, 0, 0, 0, 2, 0, 0],
+    [0, 0, 0, 2, 0, 1, 0, 0, 0, 0, 0, 0, 2],
+], dtype=np.int32)
+_GUIDES = np.array([
+    [[_ZERO, _CY], [_X1, _CY]],
+    [[_X2, _CY], [_WIDTH, _CY]],
+    [[_CX, _ZERO], [_CX, _Y1]],
+    [[_CX, _Y2], [_CX, _HEIGHT]],
+])
+_BRACKETS = np.array([
+    [[_X1C, _Y1], [_X1, _Y1], [_X1, _Y1C]],
+    [[_X2C, _Y1], [_X2, _Y1], [_X2, _Y1C]],
+    [[_X1C, _Y2], [_X1, _Y2], [_X1, _Y2C]],
+    [[_X2C, _Y2], [_X2, _Y2], [_X2, _Y2C]],
+])
+_OUTLINE = np.array([[_X1, _Y1], [_X2, _Y1], [_X2, _Y2], [_X1, _Y2]])
+_OUTLINE_GROW = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.int32)
 
 class TextOverlay:
-    def __init__(self):
-        self.current_text = None
-        self.text_duration = 0
-        self.text_frame = 0
-        self.text_position = None
-        self.text_style = None
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.pool = FramePool()
+        self.profiler = NULL_PROFILER
+        # Positions and sizes in the plan and below are for the source
+        # resolution; proxy renders set this to their fraction of it.
+        self.scale = 1.0
+        # "source" draws captions where the plan puts them; "centered"
+        # (narrow renditions) centres them across and puts them at the same
+        # fraction of the output height as in the source, whatever part of
+        # the source the rendition crops.
+        self.layout = "source"
         self.font_size = 40
 
+    def scaled(self, value, minimum=1):
+        return max(minimum, int(round(value * self.scale)))
+
+    def caption_position(self, caption, text, font_size, frame_shape):
+        if self.layout == "centered":
+            frame_height, frame_width = frame_shape[:2]
+            left, _, right, _ = load_font(font_size).getbbox(text)
+            y = caption["position"][1] * frame_height // max(self.plan.height, 1)
+            return (max(0, (frame_width - (right - left)) // 2), y)
+        return tuple(self.scaled(v, 0) for v in caption["position"])
+
     def get_font(self, size):
-        try:
-            return ImageFont.truetype("arial.ttf", size)
-        except:
-            try:
-                return ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size)
-            except:
-                return ImageFont.load_default()
+        return load_font(size)
 
     def add_text_pil(self, frame, text, position, font_size=40, color=(255, 255, 255), shadow=True):
-        img_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(img_pil)
-        font = self.get_font(font_size)
-        
         x, y = position
         
         if shadow:
-            shadow_color = random.choice(SHADOW_COLORS)
+            shadow_sprite = render_text_sprite(text, font_size, random.choice(SHADOW_COLORS))
             for offset in [(2, 2), (3, 3)]:
-                draw.text((x + offset[0], y + offset[1]), text, font=font, fill=shadow_color)
-        
-        draw.text((x, y), text, font=font, fill=color)
+                shadow_sprite.blend(frame, (x + offset[0], y + offset[1]))
         
-        return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+        return render_text_sprite(text, font_size, tuple(color)).blend(frame, position)
 
     def add_outlined_text(self, frame, text, position, font_size=40, color=(255, 255, 255), outline_color=(0, 0, 0)):
-        img_pil = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        draw = ImageDraw.Draw(img_pil)
-        font = self.get_font(font_size)
-        
-        x, y = position
-        outline_width = 3
-        
-        for dx in range(-outline_width, outline_width + 1):
-            for dy in range(-outline_width, outline_width + 1):
-                if dx != 0 or dy != 0:
-                    draw.text((x + dx, y + dy), text, font=font, fill=outline_color)
-        
-        draw.text((x, y), text, font=font, fill=color)
-        
-        return cv2.cvtColor(np.array(img_pil), cv2.COLOR_RGB2BGR)
+        outline_width = min(self.scaled(3), TEXT_OUTLINE_MAX_WIDTH)
+        sprite = render_outlined_text_sprite(text, font_size, outline_width)
+        return sprite.blend(frame, position, tuple(color), tuple(outline_color))
 
 
     def add_animated_text(self, frame, text, position, frame_idx, font_size=40, color=(255, 255, 255)):
+        # The pulse snaps to a few pre-rendered sizes so each caption needs
+        # at most TEXT_ANIMATION_STEPS sprites instead of one per frame.
         scale = 1.0 + 0.1 * np.sin(frame_idx * 0.2)
+        if TEXT_ANIMATION_STEPS > 1:
+            step = 0.2 / (TEXT_ANIMATION_STEPS - 1)
+            scale = 0.9 + round((scale - 0.9) / step) * step
+        else:
+            scale = 1.0
         adjusted_size = int(font_size * scale)
         return self.add_outlined_text(frame, text, position, adjusted_size, color)
 
-    def add_glitch_text(self, frame, text, position, font_size=40, color=(255, 255, 255)):
-        if random.random() < 0.3:
-            offset = random.randint(-5, 5)
-            position = (position[0] + offset, position[1])
+    def add_glitch_text(self, frame, text, position, font_size=40, color=(255, 255, 255), rng=random):
+        if rng.random() < 0.3:
+            offset = rng.randint(-5, 5)
+            position = (position[0] + int(round(offset * self.scale)), position[1])
         
         frame = self.add_outlined_text(frame, text, position, font_size, color)
         
-        if random.random() < 0.2:
-            r_offset = random.randint(-3, 3)
-            frame_copy = frame.copy()
-            frame[:, :, 2] = np.roll(frame_copy[:, :, 2], r_offset, axis=1)
+        if rng.random() < 0.2:
+            # np.roll of the red channel, staged through one pooled plane
+            # instead of copying the whole frame.
+            w = frame.shape[1]
+            r_offset = int(round(rng.randint(-3, 3) * self.scale)) % w
+            if r_offset:
+                red = self.pool.buffer("glitch", frame.shape[:2])
+                red[:] = frame[:, :, 2]
+                frame[:, r_offset:, 2] = red[:, :w - r_offset]
+                frame[:, :r_offset, 2] = red[:, w - r_offset:]
         
         return frame
 
-    def add_person_label(self, frame, bbox, label="PERSON", confidence=0.0):
-        x1, y1, x2, y2 = map(int, bbox)
-        
-        labels = ["MAIN CHARACTER", "NPC", "LEGEND", "GOAT", "REAL ONE", "VIBE CHECK", "W", "ICONIC"]
-        label = random.choice(labels) if random.random() < 0.5 else f"CONF: {confidence:.0%}"
-        
-        color = random.choice(COLORS)
-        
-        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-        
-        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-        cv2.rectangle(frame, (x1, y1 - 25), (x1 + label_size[0] + 10, y1), color, -1)
-        cv2.putText(frame, label, (x1 + 5, y1 - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
-        
-        return frame
+    def add_detection_overlays(self, frame, detections, rng=random):
+        # Crowd shots have dozens of people, so instead of a dozen OpenCV
+        # calls per box every layer (guide lines, corner brackets, outlines)
+        # is drawn with one cv2.polylines call per colour, and label tags
+        # are cached sprites. Labels go on top of all the lines. The random
+        # picks are drawn in the same order as before, box by box.
+        detections = np.asarray(detections, dtype=np.float32)
+        if detections.shape[1] > 4:
+            confidences = detections[:, 4].tolist()
+        else:
+            confidences = [0.0] * len(detections)
+        tracked, tagged, labels = {}, {}, []
+        for i, confidence in enumerate(confidences):
+            if rng.random() < 0.7:
+                tracked.setdefault(rng.choice(COLORS), []).append(i)
+            if rng.random() < 0.5:
+                label = rng.choice(PERSON_LABELS) if rng.random() < 0.5 else f"CONF: {confidence:.0%}"
+                color = rng.choice(COLORS)
+                tagged.setdefault(color, []).append(i)
+                labels.append((i, label, color))
+        return self.draw_detection_layers(frame, detections, tracked, tagged, labels)
 
-    def add_tracking_lines(self, frame, bbox, color=None):
-        if color is None:
-            color = random.choice(COLORS)
-        
-        x1, y1, x2, y2 = map(int, bbox)
-        cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+    def draw_detection_layers(self, frame, detections, tracked, tagged, labels):
+        # tracked and tagged map a colour to the rows of detections that get
+        # tracking lines or an outline in it; labels are (row, text, colour).
         h, w = frame.shape[:2]
-        
-        cv2.line(frame, (0, cy), (x1, cy), color, 1)
-        cv2.line(frame, (x2, cy), (w, cy), color, 1)
-        cv2.line(frame, (cx, 0), (cx, y1), color, 1)
-        cv2.line(frame, (cx, y2), (cx, h), color, 1)
-        
-        corner_len = 20
-        cv2.line(frame, (x1, y1), (x1 + corner_len, y1), color, 3)
-        cv2.line(frame, (x1, y1), (x1, y1 + corner_len), color, 3)
-        cv2.line(frame, (x2, y1), (x2 - corner_len, y1), color, 3)
-        cv2.line(frame, (x2, y1), (x2, y1 + corner_len), color, 3)
-        cv2.line(frame, (x1, y2), (x1 + corner_len, y2), color, 3)
-        cv2.line(frame, (x1, y2), (x1, y2 - corner_len), color, 3)
-        cv2.line(frame, (x2, y2), (x2 - corner_len, y2), color, 3)
-        cv2.line(frame, (x2, y2), (x2, y2 - corner_len), color, 3)
-        
+        corner = self.scaled(20)
+        offsets = np.array([0, 0, 0, 0, 0, 0, 0, w, h, corner, -corner, corner, -corner], dtype=np.int32)
+        table = (detections[:, :4].astype(np.int32) @ _TABLE_WEIGHTS + 2 * offsets) // 2
+
+        for color, members in tracked.items():
+            cv2.polylines(frame, list(table[members][:, _GUIDES].reshape(-1, 2, 2)), False, color, 1)
+        corner_width = self.scaled(3)
+        for color, members in tracked.items():
+            cv2.polylines(frame, list(table[members][:, _BRACKETS].reshape(-1, 3, 2)), False, color, corner_width)
+        # Outlines are nested one-pixel rectangles covering the same band as
+        # cv2.rectangle at this thickness; cv2 draws thick lines as polygons
+        # with round caps, which costs several times as much.
+        thickness = self.scaled(2)
+        reach = (thickness + 1) // 2 if thickness > 1 else 0
+        for color, members in tagged.items():
+            outlines = table[members][:, _OUTLINE]
+            for grow in range(-reach, reach + 1):
+                cv2.polylines(frame, list(outlines + grow * _OUTLINE_GROW), True, color, 1)
+
+        font_scale = 0.6 * self.scale
+        height, pad, baseline = self.scaled(25), self.scaled(5), self.scaled(7)
+        corners = table[:, :2].tolist()
+        for i, label, color in labels:
+            sprite = render_label_sprite(label, color, font_scale, thickness, height, pad, baseline)
+            sprite.paste(frame, (corners[i][0], corners[i][1] - height))
         return frame
 
-    def process_frame(self, frame, detections=None, frame_idx=0, total_frames=1):
-        h, w = frame.shape[:2]
+    # Single-box entry points, kept for callers of the per-box API; they draw
+    # through the same batched layers as add_detection_overlays.
+    def add_person_label(self, frame, bbox, label="PERSON", confidence=0.0, rng=random):
+        label = rng.choice(PERSON_LABELS) if rng.random() < 0.5 else f"CONF: {confidence:.0%}"
+        color = rng.choice(COLORS)
+        box = np.asarray([bbox[:4]], dtype=np.float32)
+        return self.draw_detection_layers(frame, box, {}, {color: [0]}, [(0, label, color)])
+
+    def add_tracking_lines(self, frame, bbox, color=None, rng=random):
+        if color is None:
+            color = rng.choice(COLORS)
+        box = np.asarray([bbox[:4]], dtype=np.float32)
+        return self.draw_detection_layers(frame, box, {color: [0]}, {}, [])
+
+    def ensure_plan(self, frame, total_frames):
+        if self.plan is None:
+            h, w = frame.shape[:2]
+            self.plan = EditPlan.generate(random.randrange(2 ** 32), total_frames, w, h)
+        return self.plan
+
+    def process_frame(self, frame, detections=None, frame_idx=0, total_frames=1, out=None):
+        # Overlays draw in place; with out= the frame is copied there first.
+        if out is not None and out is not frame:
+            np.copyto(out, frame)
+            frame = out
+        plan = self.ensure_plan(frame, total_frames)
+        caption = plan.caption_at(frame_idx)
+        has_detections = detections is not None and len(detections) > 0
+        if caption is None and not has_detections and frame_idx >= plan.intro["end"]:
+            return frame
+        rng = plan.frame_rng(frame_idx, "overlay")
         
-        if frame_idx < 60:
-            intro = get_random_intro() if frame_idx == 0 or self.current_text is None else self.current_text
-            if frame_idx == 0:
-                self.current_text = intro
+        if frame_idx < plan.intro["end"]:
             alpha = min(1.0, frame_idx / 20)
             if alpha > 0:
-                frame = self.add_animated_text(frame, intro, (50, 50), frame_idx, 50, (255, 255, 0))
-        
-        if random.random() < 0.01 and self.text_duration == 0:
-            self.current_text = get_random_caption()
-            self.text_duration = random.randint(30, 90)
-            self.text_position = (random.randint(50, w - 300), random.randint(h // 2, h - 100))
-            self.text_style = random.choice(["normal", "glitch", "animated"])
+                frame = self.add_animated_text(frame, plan.intro["text"], (self.scaled(50), self.scaled(50)), frame_idx,
+                                               self.scaled(50, 8), (255, 255, 0))
         
-        if self.text_duration > 0:
-            if self.text_style == "glitch":
-                frame = self.add_glitch_text(frame, self.current_text, self.text_position, 45, get_random_color())
-            elif self.text_style == "animated":
-                frame = self.add_animated_text(frame, self.current_text, self.text_position, frame_idx, 45, get_random_color())
+        if caption is not None:
+            started = self.profiler.start()
+            text, style = caption["text"], caption["style"]
+            font_size = self.scaled(45, 8)
+            position = self.caption_position(caption, text, font_size, frame.shape)
+            color = rng.choice(COLORS)
+            if style == "glitch":
+                frame = self.add_glitch_text(frame, text, position, font_size, color, rng=rng)
+            elif style == "animated":
+                frame = self.add_animated_text(frame, text, position, frame_idx, font_size, color)
             else:
-                frame = self.add_outlined_text(frame, self.current_text, self.text_position, 45, get_random_color())
-            self.text_duration -= 1
+                frame = self.add_outlined_text(frame, text, position, font_size, color)
+            self.profiler.stop(f"overlay.caption.{style}", started)
         
-        if detections is not None:
-            for det in detections:
-                bbox = det[:4]
-                conf = det[4] if len(det) > 4 else 0.0
-                
-                if random.random() < 0.7:
-                    frame = self.add_tracking_lines(frame, bbox)
-                
-                if random.random() < 0.5:
-                    frame = self.add_person_label(frame, bbox, confidence=conf)
+        if has_detections:
+            started = self.profiler.start()
+            frame = self.add_detection_overlays(frame, detections, rng=rng)
+            self.profiler.stop("overlay.detections", started)
         
-        return frame
\ No newline at end of file
+        return frame
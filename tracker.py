@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+from config import (
+    DETECTION_INTERVAL_MIN, DETECTION_INTERVAL_MAX, TRACKER_IOU_THRESHOLD,
+    TRACKER_MAX_MISSES, TRACKER_MIN_HITS, SCENE_CUT_THRESHOLD, SCENE_MOTION_THRESHOLD
+)
+
+def box_iou(a, b):
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+class Track:
+    def __init__(self, detection):
+        # Constant-velocity model over (cx, cy, w, h).
+        self.kf = cv2.KalmanFilter(8, 4)
+        self.kf.transitionMatrix = np.eye(8, dtype=np.float32)
+        for i in range(4):
+            self.kf.transitionMatrix[i, i + 4] = 1.0
+        self.kf.measurementMatrix = np.eye(4, 8, dtype=np.float32)
+        self.kf.processNoiseCov = np.diag([1, 1, 1, 1, 0.5, 0.5, 0.1, 0.1]).astype(np.float32)
+        self.kf.measurementNoiseCov = np.eye(4, dtype=np.float32) * 4.0
+        self.kf.errorCovPost = np.diag([10, 10, 10, 10, 100, 100, 100, 100]).astype(np.float32)
+        self.kf.statePost = np.zeros((8, 1), dtype=np.float32)
+        self.kf.statePost[:4, 0] = self._to_measurement(detection[:4])
+        self.confidence = float(detection[4])
+        self.cls = float(detection[5])
+        self.hits = 1
+        self.misses = 0
+
+    def _to_measurement(self, box):
+        x1, y1, x2, y2 = box
+        return np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], dtype=np.float32)
+
+    def predict(self):
+        self.kf.predict()
+
+    def correct(self, detection):
+        self.kf.correct(self._to_measurement(detection[:4]).reshape(4, 1))
+        self.confidence = float(detection[4])
+        self.hits += 1
+        self.misses = 0
+
+    def box(self):
+        cx, cy, w, h = self.kf.statePost[:4, 0]
+        w, h = max(w, 1.0), max(h, 1.0)
+        return [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2, self.confidence, self.cls]
+
+class PersonTracker:
+    def __init__(self):
+        self.tracks = []
+        self.interval = DETECTION_INTERVAL_MIN
+        self.prev_thumb = None
+
+    def reset(self):
+        self.tracks = []
+        self.interval = DETECTION_INTERVAL_MIN
+
+    def scene_change(self, frame):
+        thumb = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        prev, self.prev_thumb = self.prev_thumb, thumb
+        if prev is None:
+            return "cut"
+        diff = float(cv2.absdiff(thumb, prev).mean())
+        if diff >= SCENE_CUT_THRESHOLD:
+            return "cut"
+        if diff >= SCENE_MOTION_THRESHOLD:
+            return "motion"
+        return None
+
+    def scheduled_interval(self, change):
+        if change == "cut":
+            return DETECTION_INTERVAL_MIN
+        if change == "motion":
+            return min(self.interval, max(DETECTION_INTERVAL_MIN, DETECTION_INTERVAL_MAX // 10))
+        return self.interval
+
+    def predict(self):
+        for track in self.tracks:
+            track.predict()
+        return self.boxes()
+
+    def update(self, detections):
+        for track in self.tracks:
+            track.predict()
+
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+        matched_tracks = set()
+        matched_dets = set()
+
+        if self.tracks and len(detections):
+            predicted = np.array([track.box()[:4] for track in self.tracks], dtype=np.float32)
+            ious = box_iou(predicted, detections[:, :4])
+            for flat in np.argsort(-ious, axis=None):
+                t, d = np.unravel_index(flat, ious.shape)
+                if ious[t, d] < TRACKER_IOU_THRESHOLD:
+                    break
+                if t in matched_tracks or d in matched_dets:
+                    continue
+                self.tracks[t].correct(detections[d])
+                matched_tracks.add(t)
+                matched_dets.add(d)
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= TRACKER_MAX_MISSES]
+
+        for d in range(len(detections)):
+            if d not in matched_dets:
+                self.tracks.append(Track(detections[d]))
+
+        stable = (
+            len(matched_dets) == len(detections)
+            and len(matched_tracks) == len(self.tracks)
+            and all(track.hits >= TRACKER_MIN_HITS for track in self.tracks)
+        )
+        if stable:
+            self.interval = min(self.interval * 2, DETECTION_INTERVAL_MAX)
+        else:
+            self.interval = DETECTION_INTERVAL_MIN
+
+        return self.boxes()
+
+    def boxes(self):
+        if not self.tracks:
+            return np.zeros((0, 6), dtype=np.float32)
+        return np.array([track.box() for track in self.tracks], dtype=np.float32)